@@ -0,0 +1,59 @@
+# Output backends
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Builders don't print build file syntax themselves, they describe rules
+# and build edges to the current writer:
+#
+#   rule(name, command, ...)   declare a command template; {in} and {out}
+#                              are the edge's inputs and output, any other
+#                              {name} is an edge variable or a global one
+#   build(outputs, rule, inputs, implicit, order_only, variables, phony)
+#   phony(name, deps)
+#   variable(name, value, weak=False, append=False)
+#   ref(name)                  how to refer to a variable in a value
+#   include(path)              read another build file in at this point
+#
+# The writer records all of that as a graph (see graph.py), which each
+# backend turns into its own syntax when it's closed.
+
+import importlib
+
+backends = ['make', 'ninja']
+
+current_writer = None
+
+def select(name, output):
+    global current_writer
+    mod = importlib.import_module(f"{__name__}.{name}")
+    current_writer = mod.Writer(output)
+    return current_writer
+
+def settings(name) -> list:
+    # what a backend bakes into the build file besides the graph itself
+    mod = importlib.import_module(f"{__name__}.{name}")
+    return mod.settings() if hasattr(mod, 'settings') else []
+
+def writer():
+    return current_writer
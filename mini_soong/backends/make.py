@@ -0,0 +1,92 @@
+# GNU Make backend
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from ..graph import Graph, join
+
+class Recipe(dict):
+    def __init__(self, writer, inputs, variables):
+        super().__init__(variables)
+        self['in'] = '$<' if len(inputs) == 1 else join(inputs)
+        self['out'] = '$@'
+        self.writer = writer
+
+    def __missing__(self, key):
+        return self.writer.ref(key)
+
+class Writer(Graph):
+    def ref(self, name: str) -> str:
+        return f"$({name})"
+
+    def write_variable(self, node):
+        op = '?=' if node.weak else '+=' if node.append else '='
+        yield f"{node.name:<{node.align}} {op} {node.value}".rstrip()
+
+    def write_soversion(self, node):
+        yield f"{node.name}_soversion ?= {node.version}"
+        yield f"{node.name}_somajor    = $(basename $(basename $({node.name}_soversion)))"
+
+    def write_buildflags(self, node):
+        yield "DPKG_EXPORT_BUILDFLAGS = 1"
+        yield "-include /usr/share/dpkg/buildflags.mk"
+        yield ''
+
+    def write_builddir(self, node):
+        return ()
+
+    def write_rule(self, node):
+        return ()
+
+    def write_build(self, node):
+        if node.phony:
+            yield f".PHONY: {join(node.outputs)}"
+        line = f"{join(node.outputs)}: {join(node.inputs + node.implicit)}".rstrip()
+        if node.order_only:
+            line += f" | {join(node.order_only)}"
+        yield line
+        if '/' in node.outputs[0]:
+            yield "\t@mkdir -p $(@D)"
+        recipe = Recipe(self, node.inputs, node.variables)
+        rule = self.rules[node.rule]
+        for command in rule.commands:
+            # not marked with +, or make -n would run them: the compiler
+            # finds the jobserver in MAKEFLAGS, or uses every CPU instead
+            yield f"\t{' '.join(command.format_map(recipe).split())}"
+        if 'depfile' in node.variables:
+            yield f"-include {node.variables['depfile']}"
+
+    def write_phony(self, node):
+        yield f".PHONY: {node.name}"
+        yield f"{node.name}: {join(node.deps)}".rstrip()
+
+    def write_regenerate(self, node):
+        # make remakes included makefiles first and restarts if they change;
+        # mini-soong always refreshes the stamp but only rewrites the
+        # Makefile itself when the inputs actually changed
+        yield f"-include {node.stamp}"
+        yield f"{node.stamp}: {join(node.inputs)}"
+        yield f"\t$(MINI_SOONG) {node.args.replace('$', '$$')}"
+
+    def write_default(self, node):
+        yield f".DEFAULT_GOAL := {node.target}"
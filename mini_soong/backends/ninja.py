@@ -0,0 +1,177 @@
+# Ninja backend
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from ..graph import Graph, Variable, join
+from functools import lru_cache
+from pathlib import Path
+import os
+import re
+import shutil
+
+# variables only known when ninja runs, e.g. DESTDIR=... ninja install
+environment = ['DESTDIR']
+
+tools = {
+    'CC': 'cc',
+    'CXX': 'g++',
+    'AR': 'ar',
+}
+
+buildflags = ['CPPFLAGS', 'CFLAGS', 'CXXFLAGS', 'LDFLAGS']
+
+@lru_cache(maxsize=None)
+def dpkg_buildflags(flag: str) -> str:
+    import sh
+    try:
+        return sh.Command('dpkg-buildflags')('--get', flag).rstrip()
+    except sh.CommandNotFound:
+        return ''
+
+# besides the variables it reads, dpkg-buildflags depends on these
+dpkg_config = ['/etc/dpkg/buildflags.conf', '/etc/dpkg/origins/default']
+
+def settings() -> list:
+    """
+    Return what the tools and flags baked into the build file depend on,
+    for the fingerprint: running dpkg-buildflags just to find out nothing
+    changed would take longer than the rest of a run which does nothing.
+    """
+    values = [f"{name}={os.environ.get(name, '')}" for name in list(tools) + buildflags]
+    values += [f"{name}={value}" for name, value in sorted(os.environ.items()) if name.startswith(('DEB_', 'DPKG_'))]
+    # the flags map the current directory to . in debug information
+    values.append(f"cwd={os.getcwd()}")
+    path = shutil.which('dpkg-buildflags')
+    if path:
+        values.append(f"{path}:{os.stat(path).st_mtime_ns}")
+    config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    for config in dpkg_config + [os.path.join(config_home, 'dpkg', 'buildflags.conf')]:
+        try:
+            values.append(f"{config}:{Path(config).read_text()}")
+        except OSError:
+            pass
+    return values
+
+def mangle(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name.strip())
+
+class Rule(dict):
+    def __init__(self, writer):
+        super().__init__({'in': '$in', 'out': '$out'})
+        self.writer = writer
+
+    def __missing__(self, key):
+        return self.writer.ref(key)
+
+class Writer(Graph):
+    def __init__(self, output):
+        super().__init__(output)
+        self.defined = set()
+        self.pools = set()
+
+    def ref(self, name: str) -> str:
+        if name in environment:
+            return f"$${{{name}}}"
+        return f"${{{mangle(name)}}}"
+
+    def write_variable(self, node):
+        name = mangle(node.name)
+        if name in environment or (node.weak and name in self.defined):
+            return
+        value = node.value
+        if node.append:
+            value = f"{self.ref(name)} {value}"
+        self.defined.add(name)
+        yield f"{name} = {value}".rstrip()
+
+    def write_soversion(self, node):
+        somajor = node.version
+        for _ in range(2):
+            somajor = somajor.rsplit('.', 1)[0]
+        yield from self.write_variable(Variable(f"{node.name}_soversion", node.version, False, False))
+        yield from self.write_variable(Variable(f"{node.name}_somajor", somajor, False, False))
+
+    def write_buildflags(self, node):
+        for tool, default in tools.items():
+            yield from self.write_variable(Variable(tool, os.environ.get(tool, default), False, False))
+        for flag in buildflags:
+            yield from self.write_variable(Variable(flag, os.environ[flag] if flag in os.environ else dpkg_buildflags(flag), False, False))
+        yield ''
+
+    def write_builddir(self, node):
+        # ninja keeps its log and dependency database there
+        if node.path != '.':
+            yield f"builddir = {node.path}"
+            yield ''
+
+    def write_rule(self, node):
+        if node.jobserver and 'jobserver' not in self.pools:
+            # ninja has no jobserver to share, so commands running
+            # parallel jobs of their own take turns instead
+            self.pools.add('jobserver')
+            yield "pool jobserver"
+            yield "  depth = 1"
+            yield ''
+        yield f"rule {node.name}"
+        yield f"  command = {' && '.join(' '.join(c.format_map(Rule(self)).split()) for c in node.commands)}"
+        if node.deps:
+            yield f"  deps = {node.deps}"
+        if node.description:
+            yield f"  description = {node.description.format_map(Rule(self))}"
+        if node.restat:
+            yield "  restat = 1"
+        if node.generator:
+            yield "  generator = 1"
+        if node.jobserver:
+            yield "  pool = jobserver"
+        yield ''
+
+    def write_build(self, node):
+        # phony edges need nothing more: their outputs are never written,
+        # so ninja runs them every time
+        line = f"build {join(node.outputs)}: {node.rule} {join(node.inputs)}".rstrip()
+        if node.implicit:
+            line += f" | {join(node.implicit)}"
+        if node.order_only:
+            line += f" || {join(node.order_only)}"
+        yield line
+        for name, value in node.variables.items():
+            yield f"  {name} = {value}".rstrip()
+
+    def write_phony(self, node):
+        yield f"build {node.name}: phony {join(node.deps)}".rstrip()
+
+    def write_regenerate(self, node):
+        # mini-soong leaves the output alone when the inputs didn't
+        # really change, restat makes ninja notice that
+        yield "rule regen"
+        yield f"  command = ${{MINI_SOONG}} {node.args.replace('$', '$$')}"
+        yield f"  description = Regenerating {node.output}"
+        yield "  generator = 1"
+        yield "  restat = 1"
+        yield ''
+        yield f"build {node.output}: regen {join(node.inputs)}"
+
+    def write_default(self, node):
+        yield f"default {node.target}"
@@ -0,0 +1,102 @@
+# Benchmark results
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# The bench target leaves the results of each benchmark as written by
+# google-benchmark with --benchmark_out_format=json. This summarises
+# them and compares them with the results of an earlier run, matched
+# by file and benchmark name.
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+units = {'ns': 1, 'us': 1e3, 'ms': 1e6, 's': 1e9}
+
+def load(path: Path) -> dict:
+    """
+    Return the real time per iteration of each benchmark in nanoseconds,
+    preferring the mean over repetitions when there are any.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    times = dict()
+    means = dict()
+    for run in data.get('benchmarks', []):
+        time = run['real_time'] * units.get(run.get('time_unit', 'ns'), 1)
+        if run.get('run_type') == 'aggregate':
+            if run.get('aggregate_name') == 'mean':
+                means[run['run_name']] = time
+        else:
+            times[run['name']] = time
+    times.update(means)
+    return times
+
+def format_time(ns: float) -> str:
+    for unit in ['s', 'ms', 'us']:
+        if ns >= units[unit]:
+            return f"{ns / units[unit]:.3g} {unit}"
+    return f"{ns:.3g} ns"
+
+def report(results, baseline: Path = None, threshold: float = 5.0, file=sys.stdout) -> int:
+    """
+    Print the results, with the change against the baseline, and
+    return the largest slowdown in percent.
+    """
+    worst = 0.0
+    for path in results:
+        path = Path(path)
+        current = load(path)
+        before = dict()
+        if baseline and (baseline / path.name).exists():
+            before = load(baseline / path.name)
+        print(f"{path.stem}:", file=file)
+        for name, time in current.items():
+            line = f"  {name:<40} {format_time(time):>10}"
+            if name in before and before[name]:
+                change = (time - before[name]) / before[name] * 100
+                worst = max(worst, change)
+                mark = ' slower' if change > threshold else ' faster' if change < -threshold else ''
+                line += f"  {format_time(before[name]):>10}  {change:+6.1f}%{mark}"
+            print(line, file=file)
+    return worst
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(prog='mini-soong bench-report', description='Summarise benchmark results and compare them with a baseline')
+    parser.add_argument('results', metavar='RESULTS', nargs='+', help='JSON results written by the bench target')
+    parser.add_argument('--baseline', metavar='DIR', type=str, default='', help='directory with the results of an earlier run to compare with')
+    parser.add_argument('--threshold', metavar='PCT', type=float, default=5.0, help='changes smaller than this are noise (default: 5)')
+    parser.add_argument('--fail-above', metavar='PCT', type=float, help='fail if any benchmark got slower by more than this')
+    args = parser.parse_args(argv)
+    try:
+        worst = report(args.results, Path(args.baseline) if args.baseline else None, args.threshold)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    if args.fail_above is not None and worst > args.fail_above:
+        print(f"ERROR: a benchmark got {worst:.1f}% slower", file=sys.stderr)
+        return 1
+    return 0
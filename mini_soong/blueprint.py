@@ -0,0 +1,193 @@
+# Blueprint lexer and parser
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# A hand-written replacement for the pyparsing grammar in parser.py.
+# It accepts everything that grammar does, and additionally any value
+# (not just strings) in lists, + on any pair of values of the same type,
+# and += assignments. Like the pyparsing grammar, strings are returned
+# with their quotes removed but escapes left alone, and variables live
+# in a dictionary shared between all recipes parsed.
+
+import re
+from copy import deepcopy
+from .model import Module
+
+# bump when the parse result for the same input changes
+version = 1
+
+variables = dict()
+
+token_re = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<int>-?[0-9]+)
+  | (?P<ident>[^\W\d]\w*)
+  | (?P<op>\+=|[{}\[\]:=,+])
+  | (?P<error>.)
+''', re.VERBOSE | re.DOTALL)
+
+keywords = {
+    'true': True,
+    'false': False,
+    'null': None,
+}
+
+class ParseError(Exception):
+    def __init__(self, message: str, text: str, pos: int):
+        self.line = text.count('\n', 0, pos) + 1
+        self.column = pos - text.rfind('\n', 0, pos)
+        super().__init__(f"{self.line}:{self.column}: {message}")
+
+def tokenize(text: str):
+    tokens = []
+    for m in token_re.finditer(text):
+        kind = m.lastgroup
+        if kind == 'space' or kind == 'comment':
+            continue
+        if kind == 'error':
+            raise ParseError(f"unexpected character {m.group()!r}", text, m.start())
+        tokens.append((kind, m.group(), m.start()))
+    tokens.append(('eof', '', len(text)))
+    return tokens
+
+def add_values(left, right):
+    if isinstance(left, dict) and isinstance(right, dict):
+        merged = dict(left)
+        for k, v in right.items():
+            merged[k] = add_values(merged[k], v) if k in merged else v
+        return merged
+    if type(left) is not type(right) or isinstance(left, bool) or left is None:
+        raise TypeError(f"cannot add {type(right).__name__} to {type(left).__name__}")
+    return left + right
+
+class Parser:
+    def __init__(self, text: str, variables: dict):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.variables = variables
+
+    def error(self, message: str, token=None):
+        return ParseError(message, self.text, (token or self.tokens[self.pos])[2])
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, value: str):
+        token = self.next()
+        if token[0] != 'op' or token[1] != value:
+            raise self.error(f"expected {value!r}, got {token[1] or 'end of file'!r}", token)
+        return token
+
+    def parse(self):
+        modules = []
+        while self.peek()[0] != 'eof':
+            kind, name, _ = token = self.next()
+            if kind != 'ident':
+                raise self.error(f"expected a module or an assignment, got {name!r}", token)
+            op = self.peek()[1]
+            if op == '{':
+                modules.append(Module.from_dict(name, self.map()))
+            elif op == '=':
+                self.next()
+                self.variables[name] = self.expression()
+            elif op == '+=':
+                self.next()
+                if name not in self.variables:
+                    raise self.error(f"undefined variable {name}", token)
+                self.variables[name] = self.add(self.variables[name], self.expression(), token)
+            else:
+                raise self.error(f"expected '{{', '=' or '+=' after {name}")
+        return modules
+
+    def add(self, left, right, token):
+        try:
+            return add_values(left, right)
+        except TypeError as e:
+            raise self.error(str(e), token)
+
+    def expression(self):
+        value = self.value()
+        while self.peek()[1] == '+' and self.peek()[0] == 'op':
+            token = self.next()
+            value = self.add(value, self.value(), token)
+        return value
+
+    def value(self):
+        kind, text, _ = token = self.next()
+        if kind == 'string':
+            return text[1:-1]
+        elif kind == 'int':
+            return int(text)
+        elif kind == 'ident':
+            if text in keywords:
+                return keywords[text]
+            if text not in self.variables:
+                raise self.error(f"undefined variable {text}", token)
+            return deepcopy(self.variables[text])
+        elif text == '[':
+            self.pos -= 1
+            return self.list()
+        elif text == '{':
+            self.pos -= 1
+            return self.map()
+        raise self.error(f"expected a value, got {text or 'end of file'!r}", token)
+
+    def list(self):
+        self.expect('[')
+        items = []
+        while self.peek()[1] != ']':
+            items.append(self.expression())
+            if self.peek()[1] != ',':
+                break
+            self.next()
+        self.expect(']')
+        return items
+
+    def map(self):
+        self.expect('{')
+        members = {}
+        while self.peek()[1] != '}':
+            kind, key, _ = token = self.next()
+            if kind == 'string':
+                key = key[1:-1]
+            elif kind != 'ident':
+                raise self.error(f"expected a property name, got {key or 'end of file'!r}", token)
+            self.expect(':')
+            members[key] = self.expression()
+            if self.peek()[1] != ',':
+                break
+            self.next()
+        self.expect('}')
+        return members
+
+def parse(text: str, scope: dict = None):
+    return Parser(text, variables if scope is None else scope).parse()
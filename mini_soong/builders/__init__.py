@@ -1,31 +1,61 @@
 import importlib
 import pkgutil
+from ..backends import writer
 
-builders = []
+# builders are only imported once a recipe uses one of their module
+# types; cc_library is looked for in cc.py before the others
+available = [name for _, name, _ in pkgutil.iter_modules(__path__)]
+loaded = {}
 methods = {}
 
-for _, name, _ in pkgutil.walk_packages(__path__):
+def load(name: str):
     mod = importlib.import_module(f"{__name__}.{name}")
-    builders.append(mod)
+    loaded[name] = mod
     for fn in mod.__dict__.get('__all__', []):
         methods[fn] = mod.__dict__[fn]
 
-def flag_defaults():
-    print(".PHONY: build install\n")
-    print(".DEFAULT_GOAL := build\n")
-    print("DESTDIR ?=")
-    print("prefix ?= /usr")
-    print("libdir ?= ${prefix}/lib\n")
+def method(module_type: str):
+    if module_type not in methods:
+        prefix = module_type.split('_')[0]
+        for name in ([prefix] if prefix in available else []) + available:
+            if name not in loaded:
+                load(name)
+            if module_type in methods:
+                break
+    return methods.get(module_type)
 
-    for builder in builders:
+def builders():
+    return [loaded[name] for name in available if name in loaded]
+
+def flag_defaults(module_types=()):
+    for module_type in module_types:
+        method(module_type)
+
+    w = writer()
+    w.variable('DESTDIR', '', weak=True)
+    w.variable('prefix', '/usr', weak=True)
+    w.variable('libdir', f"{w.ref('prefix')}/lib", weak=True)
+    w.variable('MINI_SOONG', 'mini-soong', weak=True)
+    w.newline()
+
+    w.rule('clean', "rm -rf {files}")
+
+    for builder in builders():
         if 'flag_defaults' in builder.__dict__:
             builder.flag_defaults()
 
+def clean_targets():
+    targets = []
+    for builder in builders():
+        if 'clean_targets' in builder.__dict__:
+            targets += builder.clean_targets()
+    return targets
+
 def extra_targets():
     install_targets = []
-    for builder in builders:
+    for builder in builders():
         if 'extra_targets' in builder.__dict__:
             install_targets += builder.extra_targets()
 
-    print(f"install: {' '.join(install_targets)}")
+    writer().phony('install', install_targets)
 
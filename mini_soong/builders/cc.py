@@ -40,25 +40,59 @@ __all__ = [
 ]
 
 from ..utils import mergedefaults, print_vars, match_libs
-from ..model import defaults, all_targets, all_modules, current_recipe
+from ..model import defaults, all_targets, all_modules, current_recipe, options, shared
+from ..backends import writer
+from ..libraries import LibraryIndex
+from .. import trace
+from ..timing import timed
+from .. import hostarch
+from copy import deepcopy
 from functools import lru_cache
 from pathlib import Path
 import os
-import sh
-
-dpkg_architecture = sh.Command('dpkg-architecture')
 
 targets_binary = list()
 targets_shlib = list()
 
+default_srcs = dict()
+
+# (name, binary, library dirs) of each benchmark, run by the bench target
+benchmarks = list()
+
+# (name, binary, library dirs, shards, gtest) of each test, run by the check target
+tests = list()
+
+# only ever shared between the variants of the same module
+compiled_objects = set()
+
+shared += [targets_binary, targets_shlib, default_srcs, benchmarks, tests]
+
+# google-benchmark, whose main() is only used when the benchmark has none
+benchmark_libs = ['libbenchmark_main', 'libbenchmark']
+
+# as in Soong, tests use googletest unless they say gtest: false; the
+# static libgtest needs the libraries after it, --as-needed having
+# dropped the ones from LDLIBS
+gtest_libs = ['libgtest_main', 'libgtest', 'libm', 'libpthread']
+
+def compilers_are_clang() -> bool:
+    return all('clang' in os.environ.get(tool, default) for tool, default in [('CC', 'cc'), ('CXX', 'g++')])
+
+# as in Soong, a module picks one with lto: { thin: true } and so on;
+# the compiler runs -flto=auto jobs through make's jobserver if it can.
+# gcc rejects -flto=thin, so ThinLTO is only asked of clang, and gcc
+# gets the parallel LTO coming closest to it instead
+lto_modes = {
+    'thin': '-flto=thin' if compilers_are_clang() else '-flto=auto',
+    'full': '-flto=auto',
+    'never': '',
+}
+
 flag_blacklist = ['-Werror', '-U_FORTIFY_SOURCE', '-m32', '-m64', '-Wno-#pragma-messages']
 
 @lru_cache(maxsize=None)
 def detect_arch():
-    if 'DEB_HOST_ARCH' in os.environ:
-        return os.environ['DEB_HOST_ARCH']
-    else:
-        return dpkg_architecture('-q', 'DEB_HOST_ARCH').rstrip()
+    return hostarch.host('DEB_HOST_ARCH')
 
 def map_arch():
     arch = detect_arch()
@@ -84,13 +118,21 @@ def multilib():
 
 @lru_cache(maxsize=None)
 def detect_multiarch():
-    if 'DEB_HOST_MULTIARCH' in os.environ:
-        return os.environ['DEB_HOST_MULTIARCH']
-    else:
-        return dpkg_architecture('-q', 'DEB_HOST_MULTIARCH').rstrip()
+    return hostarch.host('DEB_HOST_MULTIARCH')
 
+def system_libdir() -> Path:
+    return Path(f"/usr/lib/{detect_multiarch()}")
+
+@lru_cache(maxsize=None)
+def library_index():
+    sysroot = Path(options.get('sysroot') or '/')
+    libdir = sysroot / system_libdir().relative_to('/')
+    return LibraryIndex(options.get('library_path', []) + [libdir / "android", libdir])
+
+@trace.traced('builder')
 def collect_defaults(args):
     global defaults
+    w = writer()
     def_cxxflags = []
     def_cflags = []
     def_ldflags = []
@@ -98,11 +140,11 @@ def collect_defaults(args):
     def_srcs = []
     for default in args.get('defaults', []):
         if default in defaults:
-            def_cxxflags += [f"$({default}_CXXFLAGS)"]
-            def_cflags += [f"$({default}_CFLAGS)"]
-            def_ldflags += [f"$({default}_LDFLAGS)"]
-            def_ldlibs += [f"$({default}_LDLIBS)"]
-            def_srcs += [f"$({default}_SRCS)"]
+            def_cxxflags += [w.ref(f"{default}_CXXFLAGS")]
+            def_cflags += [w.ref(f"{default}_CFLAGS")]
+            def_ldflags += [w.ref(f"{default}_LDFLAGS")]
+            def_ldlibs += [w.ref(f"{default}_LDLIBS")]
+            def_srcs += [w.ref(f"{default}_SRCS")]
     arch_specific = args.get('arch', {}).get(map_arch(), {})
     mergedefaults(args, arch_specific)
     target_specific = args.get('target', {}).get('linux_glibc', {})
@@ -123,20 +165,210 @@ def relative_to(path: Path, fname: str) -> Path:
 def rel(fname: str) -> Path:
     return relative_to(current_recipe['dir'], fname)
 
+def out_path(*parts) -> str:
+    return str(Path(options.get('out_dir', '.'), *parts))
+
+def module_dir(module: str) -> str:
+    # libraries and binaries go to the top of the output directory, as
+    # they always have, and debian/*.install files may well rely on it,
+    # unless asked to go to a directory mirroring their recipe's
+    if options.get('mirror_recipes'):
+        return out_path(all_modules.recipe_dir(module))
+    return out_path()
+
+def module_output(module: str, fname: str) -> str:
+    return str(Path(module_dir(module), fname))
+
+def lib_flag(lib: str) -> str:
+    # libraries built here are linked by path, not looked up with -L
+    if lib in all_modules:
+        return module_output(lib, f"{lib}.so")
+    return f"-l{lib[3:]}"
+
+def runtime_library_dirs(args) -> list:
+    """
+    Return where the shared libraries built here that a binary needs,
+    directly or not, end up, for running it without installing them.
+    """
+    dirs = dict()
+    seen = set()
+    todo = [lib for prop in ['shared_libs', 'static_libs', 'whole_static_libs'] for lib in args.get(prop, []) + inherited_libs(args, prop)]
+    while todo:
+        lib = todo.pop()
+        if lib not in all_modules or lib in seen:
+            continue
+        seen.add(lib)
+        dirs[module_dir(lib)] = True
+        lib_args = all_modules.get(lib).arguments
+        todo += [dep for prop in ['shared_libs', 'static_libs', 'whole_static_libs'] for dep in lib_args.get(prop, []) + inherited_libs(lib_args, prop)]
+    return sorted(dirs)
+
+def timer_inputs(variables: dict, implicit) -> dict:
+    # the timing log needs the libraries a link waited for to find the critical path
+    if options.get('time_log') and implicit:
+        return dict(variables, implicit=implicit)
+    return variables
+
+def resolve_srcs(args):
+    srcs = []
+    for default in args.get('defaults', []):
+        srcs += default_srcs.get(default, [])
+    return srcs + [f"{rel(path)}" for path in args.get('srcs', [])]
+
+def object_file(objdir: str, src: str) -> str:
+    # keep the whole source name so that foo.c and foo.cpp don't collide,
+    # and never let ../ or absolute paths escape the object directory
+    parts = [('__' if part == '..' else part) for part in Path(src).parts if part != '/']
+    return f"{Path(objdir, *parts)}.o"
+
+def inherited(args, prop: str):
+    """
+    Return a property of a module, or failing that of its defaults, or None.
+    """
+    if prop in args:
+        return args[prop]
+    for default in args.get('defaults', []):
+        if default in defaults:
+            value = inherited(defaults[default], prop)
+            if value is not None:
+                return value
+    return None
+
+def inherited_libs(args, prop: str) -> list:
+    """
+    Return the libraries listed in a property of the defaults of a
+    module, and of their defaults.
+    """
+    libs = []
+    for default in args.get('defaults', []):
+        if default in defaults:
+            libs += defaults[default].get(prop, []) + inherited_libs(defaults[default], prop)
+    return libs
+
+def linker_flags(linker: str) -> str:
+    return f"-fuse-ld={linker}" if linker else ''
+
+def lto_flags(args):
+    """
+    Return the LTO flags picked in the lto block of a module or its
+    defaults, or None to use the ones of the whole build.
+    """
+    lto = inherited(args, 'lto') or {}
+    for mode, flags in lto_modes.items():
+        if lto.get(mode):
+            return flags
+    return None
+
+def unity_batches(objdir: str, srcs, size: int):
+    """
+    Split the C and the C++ sources into batches of up to size sources,
+    each to be compiled as one translation unit including all of them.
+    """
+    batches = []
+    for lang, ext in [(False, '.c'), (True, '.cpp')]:
+        group = [src for src in srcs if is_c(src) and is_cxx(src) == lang]
+        for i in range(0, len(group), size):
+            if len(group[i:i + size]) > 1:
+                batches.append((str(Path(objdir, 'unity', f"{len(batches)}{ext}")), group[i:i + size]))
+    return batches
+
+def precompiled_header(args):
+    # the header of a module is relative to it, the defaults' ones are already resolved
+    if 'precompiled_header' in args:
+        header = args['precompiled_header']
+        return str(rel(header)) if header else None
+    return inherited({'defaults': args.get('defaults', [])}, 'precompiled_header') or None
+
+def pch_rules(name: str, objdir: str, header: str, srcs, launcher: str = None, lto: str = None):
+    """
+    Precompile the header once for the C and once for the C++ sources,
+    with the module's flags, and return the flags and the dependency
+    the objects need to use it, by language.
+    """
+    w = writer()
+    pch = dict()
+    for cxx in dict.fromkeys(is_cxx(src) for src in srcs if is_c(src)):
+        # gcc picks stub.gch up instead of the stub including the header
+        stub = Path(objdir, 'pch', 'cxx.h' if cxx else 'c.h')
+        gch = f"{stub}.gch"
+        if gch not in compiled_objects:
+            compiled_objects.add(gch)
+            variables = {
+                'cflags': w.ref(f"{name}_CFLAGS"),
+                'cxxflags': w.ref(f"{name}_CXXFLAGS"),
+                'depfile': f"{stub}.d",
+                'stub': str(stub),
+                'header': os.path.relpath(header, stub.parent),
+            }
+            if launcher is not None:
+                variables['COMPILER_LAUNCHER'] = launcher
+            if lto is not None:
+                variables['LTO_FLAGS'] = lto
+            w.build([gch], 'pch_cxx' if cxx else 'pch_c', [header], variables=variables)
+        pch[cxx] = (["-include", str(stub), "-Winvalid-pch"], gch)
+    return pch
+
+def compile_rules(name: str, objdir: str, srcs, launcher: str = None, unity: int = 0, header: str = None, lto: str = None):
+    # the shared and the static variant of a library use the same objects
+    w = writer()
+    units = dict()
+    for unit, members in unity_batches(objdir, srcs, unity) if unity > 1 else []:
+        # the generated sources end up in their own .o, never clashing with .c.o
+        obj = str(Path(unit).with_suffix('.o'))
+        for src in members:
+            units[src] = (unit, obj)
+        if obj not in compiled_objects:
+            w.build([unit], 'unity', implicit=[options['output']] if options.get('output') else [], variables={
+                'includes': [os.path.relpath(src, Path(unit).parent) for src in members],
+            })
+    pairs = dict()
+    for src in srcs:
+        unit, obj = units.get(src, (src, object_file(objdir, src)))
+        pairs.setdefault(obj, unit)
+    objs = list(pairs)
+    pch = pch_rules(name, objdir, header, pairs.values(), launcher, lto) if header else {}
+    new = [(src, obj) for obj, src in pairs.items() if obj not in compiled_objects]
+    for src, obj in new:
+        compiled_objects.add(obj)
+        variables = {
+            'cflags': w.ref(f"{name}_CFLAGS"),
+            'cxxflags': w.ref(f"{name}_CXXFLAGS"),
+            'depfile': f"{obj[:-2]}.d",
+        }
+        if launcher is not None:
+            variables['COMPILER_LAUNCHER'] = launcher
+        if lto is not None:
+            variables['LTO_FLAGS'] = lto
+        implicit = []
+        if is_c(src) and is_cxx(src) in pch:
+            flags, gch = pch[is_cxx(src)]
+            flagset = 'cxxflags' if is_cxx(src) else 'cflags'
+            variables[flagset] = [variables[flagset]] + flags
+            implicit = [gch]
+        w.build([obj], 'cxx' if is_cxx(src) else 'cc', [src], implicit=implicit, variables=variables)
+    if new:
+        w.newline()
+    return objs
+
 def cc_defaults(**args):
+    w = writer()
     def_cxxflags, def_cflags, def_ldflags, def_ldlibs, def_srcs = collect_defaults(args)
     defaults[args['name']] = {k: v for k, v in args.items() if k != 'name'}
+    if args.get('precompiled_header'):
+        defaults[args['name']]['precompiled_header'] = str(rel(args['precompiled_header']))
     local_include_dirs = args.get('local_include_dirs', [])
     cxxflags = filter_flags(def_cxxflags + args.get('cppflags', []) + [f"-I{inc}" for inc in local_include_dirs])
     cflags = filter_flags(def_cflags + args.get('cflags', []) + [f"-I{rel(inc)}" for inc in local_include_dirs])
     ldflags = filter_flags(def_ldflags + args.get('ldflags', []))
-    ldlibs = def_ldlibs + [f"-l{lib[3:]}" for lib in args.get('shared_libs', [])]
+    ldlibs = def_ldlibs + [lib_flag(lib) for lib in args.get('shared_libs', [])]
     srcs = [(f"{rel(path)}" if not path.startswith('$') else path) for path in def_srcs + args.get('srcs', [])]
+    default_srcs[args['name']] = resolve_srcs(args)
     print_vars(args['name'], locals(), ['cxxflags', 'cflags', 'ldflags', 'ldlibs', 'srcs'])
-    print()
+    w.newline()
 
-def cc_compile_link(args, binary: bool = True, shared: bool = False, variables: bool = True):
-    print(f"# link {args['name']} {'shared' if shared else 'static'} library")
+def cc_compile_link(args, binary: bool = True, shared: bool = False, variables: bool = True, installed: bool = True):
+    w = writer()
+    w.comment(f"link {args['name']} {'shared' if shared else 'static'} library")
 
     def_cxxflags, def_cflags, def_ldflags, def_ldlibs, def_srcs = collect_defaults(args)
     local_include_dirs = args.get('local_include_dirs', [])
@@ -149,8 +381,8 @@ def cc_compile_link(args, binary: bool = True, shared: bool = False, variables:
     cflags = filter_flags(def_cflags + args.get('cflags', []) + [f"-I{rel(inc)}" for inc in local_include_dirs])
 
     if not binary:
-        cxxflags += [f"$({args['name']}_INCLUDES)", f"$({args['name']}_SYSTEM_INCLUDES)"]
-        cflags += [f"$({args['name']}_INCLUDES)", f"$({args['name']}_SYSTEM_INCLUDES)"]
+        cxxflags += [w.ref(f"{args['name']}_INCLUDES"), w.ref(f"{args['name']}_SYSTEM_INCLUDES")]
+        cflags += [w.ref(f"{args['name']}_INCLUDES"), w.ref(f"{args['name']}_SYSTEM_INCLUDES")]
     ldflags = filter_flags(def_ldflags + args.get('ldflags', []))
     shared_libs = args.get('shared_libs', [])
     if not binary:
@@ -158,98 +390,133 @@ def cc_compile_link(args, binary: bool = True, shared: bool = False, variables:
             mergedefaults(args, args['shared'])
         elif not shared and 'static' in args:
             mergedefaults(args, args['static'])
-    shared_libs += [lib for lib in args.get('static_libs', []) if lib not in all_modules]
-    shared_libs += [lib for lib in args.get('whole_static_libs', []) if lib not in all_modules]
-    ldlibs = def_ldlibs + [f"-l{lib[3:]}" for lib in shared_libs]
+    # the shared libraries of the defaults are in their LDLIBS already,
+    # but their archives aren't, and the link has to wait for both
+    default_shared_libs = inherited_libs(args, 'shared_libs')
+    default_static_libs = inherited_libs(args, 'static_libs')
+    default_whole_static_libs = inherited_libs(args, 'whole_static_libs')
+    shared_libs += [lib for lib in args.get('static_libs', []) + default_static_libs if lib not in all_modules]
+    shared_libs += [lib for lib in args.get('whole_static_libs', []) + default_whole_static_libs if lib not in all_modules]
+    ldlibs = def_ldlibs + [lib_flag(lib) for lib in shared_libs]
     shlibdeps = []
 
-    multiarch_libdir = Path(f"/usr/lib/{detect_multiarch()}")
-    multiarch_android_libdir = multiarch_libdir / "android"
-
-    external_android_shlibs = [lib for lib in shared_libs if (lib not in all_modules) and (multiarch_android_libdir / f"{lib}.so").exists()]
-    if external_android_shlibs:
-        ldflags += [f"-L{multiarch_android_libdir}"]
-    external_shlibs = external_android_shlibs + [lib for lib in shared_libs if (lib not in all_modules) and (multiarch_libdir / f"{lib}.so").exists()]
+    external_shlibs = dict()
+    for lib in shared_libs:
+        if lib not in all_modules:
+            path = library_index().find(f"{lib}.so")
+            if path:
+                external_shlibs[lib] = path
+    # the linker looks in the multiarch directory anyway
+    ldflags += [f"-L{libdir}" for libdir in dict.fromkeys(path.parent for path in external_shlibs.values()) if libdir != system_libdir()]
 
     for lib in shared_libs:
-        cxxflags += [f"$({lib}_INCLUDES)", f"$({lib}_SYSTEM_INCLUDES)"]
-        cflags += [f"$({lib}_INCLUDES)", f"$({lib}_SYSTEM_INCLUDES)"]
-        if lib not in external_shlibs:
-            shlibdeps += [f"{lib}.so"]
-
-    if any(lib for lib in shared_libs if lib in all_modules):
-        ldflags += ["-L."]
-
-    static_libs = [f"{lib}.a" for lib in args.get('static_libs', []) if lib in all_modules]
-    if 'whole_static_libs' in args:
-        static_libs += ["-Wl,--whole-archive"]
-        static_libs += [f"{lib}.a" for lib in args.get('whole_static_libs', []) if lib in all_modules]
-        static_libs += ["-Wl,--no-whole-archive"]
+        cxxflags += [w.ref(f"{lib}_INCLUDES"), w.ref(f"{lib}_SYSTEM_INCLUDES")]
+        cflags += [w.ref(f"{lib}_INCLUDES"), w.ref(f"{lib}_SYSTEM_INCLUDES")]
+        if lib in all_modules:
+            shlibdeps += [module_output(lib, f"{lib}.so")]
+
+    shlibdeps += [module_output(lib, f"{lib}.so") for lib in default_shared_libs if lib in all_modules]
+
+    static_libs = [module_output(lib, f"{lib}.a") for lib in args.get('static_libs', []) + default_static_libs if lib in all_modules]
+    whole_static_libs = [module_output(lib, f"{lib}.a") for lib in args.get('whole_static_libs', []) + default_whole_static_libs if lib in all_modules]
+    # archives built here are inputs of the link like the shared libraries,
+    # or a parallel build may link before they've been written
+    linkdeps = list(dict.fromkeys(shlibdeps + static_libs + whole_static_libs))
+    if 'whole_static_libs' in args or whole_static_libs:
+        static_libs += ["-Wl,--whole-archive"] + whole_static_libs + ["-Wl,--no-whole-archive"]
     srcs = [(f"{rel(path)}" if not path.startswith('$') else path) for path in def_srcs + args.get('srcs', [])]
+    all_srcs = resolve_srcs(args)
     if variables:
-        print(f"{args['name']}_DIR        = {current_recipe['dir']}")
+        w.variable(f"{args['name']}_DIR", str(current_recipe['dir']))
         if shared:
             matches = {lib: (major, ver) for lib, major, ver in match_libs([args['name']])}
             if args['name'] in matches:
                 somajor, soversion = matches[args['name']]
-                print(f"{args['name']}_soversion ?= {soversion}")
-                print(f"{args['name']}_somajor    = $(basename $(basename $({args['name']}_soversion)))")
+                w.soversion(args['name'], soversion)
             else:
-                print(f"{args['name']}_soversion ?= 0.0.0")
-                print(f"{args['name']}_somajor    = $(basename $(basename $({args['name']}_soversion)))")
-        print_vars(args['name'], locals(), ['cxxflags', 'cflags', 'ldflags', 'ldlibs', 'srcs'] + ['includes', 'system_includes'] if not binary else [])
-        print()
+                w.soversion(args['name'], "0.0.0")
+        # ninja expands variables as it reads them, so the include dirs go first
+        print_vars(args['name'], locals(), (['includes', 'system_includes'] if not binary else []) + ['cxxflags', 'cflags', 'ldflags', 'ldlibs', 'srcs'])
+        w.newline()
+    soversion = w.ref(f"{args['name']}_soversion")
+    somajor = w.ref(f"{args['name']}_somajor")
     if not binary:
-        suffix = f".so.$({args['name']}_soversion)" if shared else ".a"
-        soname = f"{args['name']}{suffix}"
-        target = soname
-        shared_flag = f"-shared -Wl,-soname,{args['name']}.so.$({args['name']}_somajor)" if shared else ""
+        suffix = f".so.{soversion}" if shared else ".a"
+        target_name = f"{args['name']}{suffix}"
+        shared_flag = f"-shared -Wl,-soname,{args['name']}.so.{somajor}" if shared else ""
     else:
-        target = args['name']
+        target_name = args['name']
         shared_flag = ""
+    target = module_output(args['name'], target_name)
+    major = module_output(args['name'], f"{args['name']}.so.{somajor}")
+    link = module_output(args['name'], f"{args['name']}.so")
+    link_flags = {
+        'libs': static_libs,
+        'cflags': w.ref(f"{args['name']}_CFLAGS"),
+        'ldflags': [w.ref(f"{args['name']}_LDFLAGS"), shared_flag],
+        'ldlibs': ["-lstdc++" if have_cxx(all_srcs) else "", w.ref(f"{args['name']}_LDLIBS")],
+    }
+    # linker: "" and lto: { never: true } in a module or its defaults
+    # turn the ones picked for the whole build off for it
+    linker = inherited(args, 'linker')
+    if linker is not None:
+        link_flags['LINKER_FLAGS'] = linker_flags(linker)
+    lto = lto_flags(args)
+    if lto is not None:
+        link_flags['LTO_FLAGS'] = lto
+    uses_lto = lto if lto is not None else lto_modes.get(options.get('lto'), '')
+    # a single compiler call for several sources writes the objects to
+    # the current directory, where those of other modules would collide,
+    # and unlike for a link, nothing gets rid of them straight away
+    per_object = options.get('per_object', True) or not (shared or binary)
+    if per_object:
+        objdir = out_path('obj', args['name'])
+        # compiler_launcher: "" in a module or its defaults turns the launcher off for it
+        # unity: false in a module or its defaults keeps it out of unity builds
+        unity = options.get('unity', 0) if inherited(args, 'unity') is not False else 0
+        objs = compile_rules(args['name'], objdir, all_srcs, inherited(args, 'compiler_launcher'), unity, precompiled_header(args), lto)
+        if shared or binary:
+            w.build([target], 'link_lto' if uses_lto else 'link', objs, implicit=linkdeps, variables=timer_inputs(link_flags, linkdeps))
+        else:
+            w.build([target], 'ar', objs)
+    else:
+        link_flags['cxxflags'] = [w.ref('CXXFLAGS'), w.ref(f"{args['name']}_CXXFLAGS")] if have_cxx(all_srcs) else ""
+        w.build([target], 'compile_link_lto' if uses_lto else 'compile_link', all_srcs, implicit=linkdeps, variables=timer_inputs(link_flags, linkdeps))
     if shared:
-        print(f"{args['name']}.so: {target}")
-    print(f"{target}: $({args['name']}_SRCS) {' '.join(shlibdeps)}")
-    print("\t" + ' '.join([
-        f"$(CC) $({args['name']}_SRCS) -o $@" if shared or binary else f"$(CC) $({args['name']}_SRCS) -c",
-        ' '.join(static_libs),
-        f"$(CPPFLAGS)",
-        f"$(CFLAGS) $({args['name']}_CFLAGS)",
-        f"$(CXXFLAGS) $({args['name']}_CXXFLAGS)" if have_cxx(srcs) else "",
-        f"$(LDFLAGS) $({args['name']}_LDFLAGS) {shared_flag}" if shared or binary else "",
-        "-lstdc++" if have_cxx(srcs) else "",
-        f"$(LDLIBS) $({args['name']}_LDLIBS)" if shared or binary else "",
-    ]))
-    if shared:
-        print(f"\tln -sf $@ $(@:.$({args['name']}_soversion)=.$({args['name']}_somajor))")
-        print(f"\tln -sf $(@:.$({args['name']}_soversion)=.$({args['name']}_somajor)) $(@:.$({args['name']}_soversion)=)")
-    if not shared and not binary:
-        print(f"\tar rcs {soname} $(patsubst %,%.o,$(notdir $(basename $({args['name']}_SRCS))))")
-        print(f"\trm $(patsubst %,%.o,$(notdir $(basename $({args['name']}_SRCS))))")
-    all_targets.append(target)
-    print()
-    print(f"clean-{target}:")
-    print(f"\trm -f {target}")
+        w.build([major], 'symlink', [target], variables={'target': target_name})
+        w.build([link], 'symlink', [major], variables={'target': f"{args['name']}.so.{somajor}"})
+    if installed:
+        all_targets.append(target)
+    w.newline()
+    clean_files = [target]
+    if per_object:
+        clean_files += [objdir]
     if shared:
-        print(f"\trm -f {args['name']}.so {args['name']}.so.$({args['name']}_somajor)")
-        print()
-        print(f"install-{target}: {target} install-{args['name']}-headers")
-        print(f"\tinstall -m644 -D -t $(DESTDIR)$(libdir) $<")
-        print(f"\tln -s $< $(DESTDIR)$(libdir)/$(<:.$({args['name']}_soversion)=.$({args['name']}_somajor))")
-        print(f"\tln -s $(<:.$({args['name']}_soversion)=.$({args['name']}_somajor)) $(DESTDIR)$(libdir)/$(<:.$({args['name']}_soversion)=)")
-        targets_shlib.append(target)
-    elif binary:
-        print()
-        print(f"install-{target}: {target}")
-        print(f"\tinstall -m755 -D -t $(DESTDIR)$(prefix)/bin $<")
-        targets_binary.append(target)
+        clean_files += [link, major]
+    w.build([f"clean-{target_name}"], 'clean', variables={'files': clean_files})
+    headers = []
     if shared and (export_include_dirs or export_system_include_dirs):
-        print()
-        print(f"install-{args['name']}-headers:")
-        print(f"\tmkdir -p $(DESTDIR)$(prefix)/include/{args['name']}")
-        for inc_dir in export_include_dirs + export_system_include_dirs:
-            print(f"\tcp -R -t $(DESTDIR)$(prefix)/include/{args['name']} {inc_dir}/*")
-    print()
+        headers = [f"install-{args['name']}-headers"]
+    if installed and shared:
+        w.newline()
+        w.build([f"install-{target_name}"], 'install_shlib', [target], implicit=headers, variables={
+            'file': target_name,
+            'major': f"{args['name']}.so.{somajor}",
+            'link': f"{args['name']}.so",
+        })
+        targets_shlib.append(target_name)
+    elif installed and binary:
+        w.newline()
+        w.build([f"install-{target_name}"], 'install_bin', [target])
+        targets_binary.append(target_name)
+    if headers:
+        w.newline()
+        w.build(headers, 'install_headers', variables={
+            'module': args['name'],
+            'headers': [f"{rel(inc_dir)}/*" for inc_dir in export_include_dirs + export_system_include_dirs],
+        })
+    w.newline()
+    return target
 
 def cc_binary(**args):
     cc_compile_link(args, binary = True, shared = False)
@@ -258,8 +525,9 @@ def cc_binary_host(**args):
     cc_compile_link(args, binary = True, shared = False)
 
 def cc_library(**args):
-    cc_compile_link(args, binary = False, shared = True)
-    cc_compile_link(args, binary = False, shared = False, variables = False)
+    # cc_compile_link merges the variant and arch properties into args
+    cc_compile_link(deepcopy(args), binary = False, shared = True)
+    cc_compile_link(deepcopy(args), binary = False, shared = False, variables = False)
 
 def cc_library_shared(**args):
     cc_compile_link(args, binary = False, shared = True)
@@ -274,20 +542,36 @@ def cc_library_host_static(**args):
     cc_compile_link(args, binary = False, shared = False)
 
 def cc_test(**args):
-    pass
+    # built and run by the check target only, never installed
+    gtest = args.get('gtest', True) is not False
+    if gtest:
+        args['shared_libs'] = args.get('shared_libs', []) + gtest_libs
+    libdirs = runtime_library_dirs(args)
+    target = cc_compile_link(args, binary = True, shared = False, installed = False)
+    # test_shards: N splits a googletest suite into N targets run in parallel;
+    # any other test would only run in full N times
+    shards = max(1, int(args.get('test_shards', 1))) if gtest else 1
+    tests.append((args['name'], target, libdirs, shards, gtest))
 
 def cc_test_host(**args):
-    pass
+    cc_test(**args)
 
 def cc_benchmark(**args):
-    pass
+    # built and run by the bench target only, never installed
+    args['shared_libs'] = args.get('shared_libs', []) + benchmark_libs
+    libdirs = runtime_library_dirs(args)
+    target = cc_compile_link(args, binary = True, shared = False, installed = False)
+    benchmarks.append((args['name'], target, libdirs))
 
 def cc_benchmark_host(**args):
-    pass
+    cc_benchmark(**args)
 
 def have_cxx(files):
     return any(is_cxx(f) for f in files)
 
+def is_c(filename):
+    return filename.endswith('.c') or is_cxx(filename)
+
 def is_cxx(filename):
     return (filename.endswith('.cc') or
             filename.endswith('.cxx') or
@@ -298,26 +582,26 @@ def is_cxx(filename):
             filename.endswith('.C'))
 
 def flag_defaults():
-    print("DPKG_EXPORT_BUILDFLAGS = 1")
-    print("-include /usr/share/dpkg/buildflags.mk\n")
-    print("CXXFLAGS += " + ' '.join([
+    w = writer()
+    w.buildflags()
+    w.variable('CXXFLAGS', [
         "-D__STDC_FORMAT_MACROS",
         "-D__STDC_CONSTANT_MACROS",
         "-std=c++11",
-    ]))
-    print("CFLAGS += " + ' '.join([
+    ], append=True)
+    w.variable('CFLAGS', [
         "-D_FILE_OFFSET_BITS=64",
         "-D_LARGEFILE_SOURCE=1",
         "-Wa,--noexecstack",
         "-fPIC",
         "-fcommon",
-    ]))
-    print("LDFLAGS += " + ' '.join([
+    ], append=True)
+    w.variable('LDFLAGS', [
         "-Wl,-z,noexecstack",
         "-Wl,--no-undefined-version",
         "-Wl,--as-needed",
-    ]))
-    print("LDLIBS += " + ' '.join([
+    ], append=True)
+    w.variable('LDLIBS', [
         f'-l{lib}' for lib in [
             "c",
             "dl",
@@ -330,17 +614,160 @@ def flag_defaults():
             "rt",
             "util",
         ]
-    ]))
-    print()
+    ], append=True)
+    # the compiler writes foo.c.d next to foo.c.o listing every header it read
+    w.variable('DEPFLAGS', "-MMD -MP", weak=True)
+    # every object is compiled by a command of its own, so a launcher
+    # like ccache sees the same command line for the same source each time
+    w.variable('COMPILER_LAUNCHER', options.get('compiler_launcher') or '', weak=True)
+    w.variable('LINKER_FLAGS', linker_flags(options.get('linker')), weak=True)
+    w.variable('LTO_FLAGS', lto_modes.get(options.get('lto'), ''), weak=True)
+    if options.get('time_log'):
+        w.variable('TIME_LOG', options['time_log'], weak=True)
+    w.newline()
+
+    w.rule('cc', timed("{COMPILER_LAUNCHER} {CC} -c {in} -o {out} {DEPFLAGS} {CPPFLAGS} {CFLAGS} {cflags} {LTO_FLAGS}"),
+           deps='gcc', description="CC {out}")
+    w.rule('cxx', timed("{COMPILER_LAUNCHER} {CXX} -c {in} -o {out} {DEPFLAGS} {CPPFLAGS} {CFLAGS} {cflags} {LTO_FLAGS} {CXXFLAGS} {cxxflags}"),
+           deps='gcc', description="CXX {out}")
+    # the stub is written next to the .gch so that the header is still
+    # found if the compiler decides it can't use the precompiled one
+    w.rule('pch_c', ["printf '#include \"%s\"\\n' {header} > {stub}",
+                     timed("{COMPILER_LAUNCHER} {CC} -x c-header -c {stub} -o {out} {DEPFLAGS} {CPPFLAGS} {CFLAGS} {cflags} {LTO_FLAGS}")],
+           deps='gcc', description="PCH {out}")
+    w.rule('pch_cxx', ["printf '#include \"%s\"\\n' {header} > {stub}",
+                       timed("{COMPILER_LAUNCHER} {CXX} -x c++-header -c {stub} -o {out} {DEPFLAGS} {CPPFLAGS} {CFLAGS} {cflags} {LTO_FLAGS} {CXXFLAGS} {cxxflags}")],
+           deps='gcc', description="PCH {out}")
+    if options.get('unity'):
+        # only touch the unity source when what it includes changes
+        w.rule('unity', [
+            "printf '#include \"%s\"\\n' {includes} > {out}.tmp",
+            "cmp -s {out}.tmp {out} && rm {out}.tmp || mv {out}.tmp {out}",
+        ], description="UNITY {out}", restat=True)
+    w.rule('ar', ["rm -f {out}", timed("{AR} rcs {out} {in}")],
+           description="AR {out}")
+    link = "{CC} {in} -o {out} {libs} {CFLAGS} {cflags} {LTO_FLAGS} {LDFLAGS} {LINKER_FLAGS} {ldflags} {LDLIBS} {ldlibs}"
+    compile_link = "{CC} {in} -o {out} {libs} {CPPFLAGS} {CFLAGS} {cflags} {cxxflags} {LTO_FLAGS} {LDFLAGS} {LINKER_FLAGS} {ldflags} {LDLIBS} {ldlibs}"
+    w.rule('link', timed(link), description="LINK {out}")
+    w.rule('compile_link', timed(compile_link), description="LINK {out}")
+    # links with LTO compile in parallel themselves, sharing make's jobs
+    w.rule('link_lto', timed(link), description="LINK {out}", jobserver=True)
+    w.rule('compile_link_lto', timed(compile_link), description="LINK {out}", jobserver=True)
+    w.rule('symlink', "ln -sf {target} {out}",
+           description="LN {out}", restat=True)
+    w.rule('install_bin', "install -m755 -D -t {DESTDIR}{prefix}/bin {in}")
+    w.rule('install_shlib', [
+        "install -m644 -D -t {DESTDIR}{libdir} {in}",
+        "ln -sf {file} {DESTDIR}{libdir}/{major}",
+        "ln -sf {major} {DESTDIR}{libdir}/{link}",
+    ])
+    w.rule('install_headers', [
+        "mkdir -p {DESTDIR}{prefix}/include/{module}",
+        "cp -R -t {DESTDIR}{prefix}/include/{module} {headers}",
+    ])
 
 def extra_targets():
+    w = writer()
     targets = []
     if targets_binary:
-        print(f"install-binaries: install-{' install-'.join(targets_binary)}")
+        w.phony('install-binaries', [f"install-{target}" for target in targets_binary])
         targets.append('install-binaries')
 
     if targets_shlib:
-        print(f"install-shlibs: install-{' install-'.join(targets_shlib)}")
+        w.phony('install-shlibs', [f"install-{target}" for target in targets_shlib])
         targets.append('install-shlibs')
 
+    if benchmarks or tests:
+        # benchmarks and tests run every time they're asked to
+        w.newline()
+        w.phony('FORCE')
+    if benchmarks:
+        bench_targets()
+    if tests:
+        check_targets()
+
     return targets
+
+def clean_targets():
+    # benchmarks and tests aren't installed, so they aren't among the targets cleaned anyway
+    targets = []
+    if benchmarks:
+        targets.append('clean-bench')
+    if tests:
+        targets.append('clean-check')
+    return targets
+
+def library_path(libdirs) -> str:
+    # an empty entry in LD_LIBRARY_PATH would be the current directory
+    if not libdirs:
+        return ''
+    return f"LD_LIBRARY_PATH={':'.join(libdirs)}$${{LD_LIBRARY_PATH:+:$$LD_LIBRARY_PATH}}"
+
+def report_targets(target: str, rule: str, results, results_dir: str, modules):
+    """
+    Add target, running rule on the results, and clean-<target>,
+    removing the modules and the results directory.
+    """
+    w = writer()
+    w.build([target], rule, results, phony=True)
+    w.build([f"clean-{target}"], 'clean', implicit=[f"clean-{name}" for name in modules], variables={
+        'files': [out_path(results_dir)],
+    }, phony=True)
+
+def bench_targets():
+    """
+    Run every benchmark, keeping its results as JSON, and compare them
+    with those in $(BENCH_BASELINE) if set.
+    """
+    w = writer()
+    w.newline()
+    w.variable('BENCH_FLAGS', '', weak=True)
+    w.variable('BENCH_BASELINE', '', weak=True)
+    w.variable('BENCH_REPORT_FLAGS', '', weak=True)
+    w.rule('bench', "{libpath} {binary} --benchmark_out={out} --benchmark_out_format=json {BENCH_FLAGS}",
+           description="BENCH {in}")
+    w.rule('bench_report', "{MINI_SOONG} bench-report --baseline={BENCH_BASELINE} {BENCH_REPORT_FLAGS} {in}")
+    results = []
+    for name, binary, libdirs in benchmarks:
+        result = out_path('bench-results', f"{name}.json")
+        w.build([result], 'bench', [binary], implicit=['FORCE'], variables={
+            'binary': binary if '/' in binary else f"./{binary}",
+            'libpath': library_path(libdirs),
+        })
+        results.append(result)
+    report_targets('bench', 'bench_report', results, 'bench-results', [name for name, _, _ in benchmarks])
+
+def check_targets():
+    """
+    Run every test, or every shard of it, as a target of its own, so
+    that make -j runs them side by side, and report how long each took.
+    """
+    w = writer()
+    w.newline()
+    w.variable('TEST_FLAGS', '', weak=True)
+    # the output of each run is kept apart and only shown when it fails
+    w.rule('test', "start=$$(date +%s%N); "
+                   "{libpath} GTEST_TOTAL_SHARDS={shards} GTEST_SHARD_INDEX={shard} "
+                   "{binary} {results} {TEST_FLAGS} > {out} 2>&1; status=$$?; "
+                   "echo \"{label}: $$(( ($$(date +%s%N) - start) / 1000000 )) ms\"; "
+                   "[ $$status -eq 0 ] || (cat {out}; exit $$status)",
+           description="TEST {label}")
+    w.rule('test_report', "{MINI_SOONG} test-report {in}")
+    logs = []
+    for name, binary, libdirs, shards, gtest in tests:
+        shard_logs = []
+        for shard in range(shards):
+            stem = f"{name}.{shard}" if shards > 1 else name
+            log = out_path('test-results', f"{stem}.log")
+            w.build([log], 'test', [binary], implicit=['FORCE'], variables={
+                'binary': binary if '/' in binary else f"./{binary}",
+                'libpath': library_path(libdirs),
+                'shards': str(shards),
+                'shard': str(shard),
+                'label': f"{name} {shard + 1}/{shards}" if shards > 1 else name,
+                'results': f"--gtest_output=json:{out_path('test-results', f'{stem}.json')}" if gtest else "",
+            })
+            shard_logs.append(log)
+        w.phony(f"check-{name}", shard_logs)
+        logs += shard_logs
+    report_targets('check', 'test_report', logs, 'test-results', [name for name, *_ in tests])
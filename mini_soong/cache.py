@@ -0,0 +1,106 @@
+# Parse cache
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Parsed recipes are stored as JSON, keyed by a hash of everything the
+# parse result depends on: the parser and its version, the variables
+# visible to the recipe, and the recipe text itself. Generated modules
+# are kept in the same place under keys of their own.
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from .model import Module
+from . import trace
+
+default_dir = '.mini-soong-cache'
+default_size = 64  # MiB
+
+class ParseCache:
+    def __init__(self, path: Path, max_size: int):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str, parser: str, scope: dict) -> str:
+        h = hashlib.sha256()
+        h.update(parser.encode())
+        h.update(b'\0')
+        h.update(json.dumps(scope, sort_keys=True, default=list).encode())
+        h.update(b'\0')
+        h.update(text.encode())
+        return h.hexdigest()
+
+    def read(self, key: str):
+        entry = self.path / f"{key}.json"
+        try:
+            with entry.open() as f:
+                data = json.load(f)
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def write(self, key: str, data):
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            tmp = self.path / f".{key}.{os.getpid()}"
+            with tmp.open('w') as f:
+                json.dump(data, f, default=list)
+            os.replace(tmp, self.path / f"{key}.json")
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def get(self, key: str):
+        data = self.read(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [Module.from_dict(name, arguments) for name, arguments in data['modules']], data['variables']
+
+    def put(self, key: str, modules, scope: dict):
+        self.write(key, {
+            'modules': [[m.name, m.arguments] for m in modules if isinstance(m, Module)],
+            'variables': scope,
+        })
+
+    def evict(self):
+        trace.count('scandir')
+        try:
+            entries = [(e, e.stat()) for e in os.scandir(self.path) if e.name.endswith('.json')]
+        except OSError:
+            return
+        trace.count('stat', len(entries))
+        total = sum(st.st_size for _, st in entries)
+        for entry, st in sorted(entries, key=lambda e: e[1].st_mtime):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(entry.path)
+                total -= st.st_size
+            except OSError:
+                pass
@@ -0,0 +1,132 @@
+# Module dependency graph
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Modules of every recipe are put in one graph before anything is
+# written, so that a module always comes after its defaults and the
+# libraries it uses. Builders rely on this: cc_defaults has to run
+# before the modules using it, and ninja expands variables when it
+# reads them, so ${libfoo_INCLUDES} must be defined before it's used.
+
+import heapq
+from .model import Module
+
+dependency_properties = ['defaults', 'shared_libs', 'static_libs', 'whole_static_libs', 'header_libs']
+
+# properties whose values are maps of variants, each of which may add dependencies
+variant_properties = ['arch', 'target', 'multilib']
+nested_properties = ['shared', 'static']
+
+class CycleError(Exception):
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super().__init__("dependency cycle: " + " -> ".join(cycle))
+
+def property_deps(args):
+    deps = []
+    for prop in dependency_properties:
+        # the pyparsing parser may nest empty lists
+        deps += [dep for dep in args.get(prop, []) if isinstance(dep, str)]
+    return deps
+
+def module_deps(args) -> list:
+    deps = property_deps(args)
+    for prop in nested_properties:
+        deps += property_deps(args.get(prop, {}))
+    for prop in variant_properties:
+        for variant in args.get(prop, {}).values():
+            deps += property_deps(variant)
+            for nested in nested_properties:
+                deps += property_deps(variant.get(nested, {}))
+    return deps
+
+def find_cycle(names, edges):
+    # any node left over after the sort is on a cycle or depends on one,
+    # so walking dependencies from it must run into a node seen already
+    node = min(names)
+    path = []
+    seen = {}
+    while node not in seen:
+        seen[node] = len(path)
+        path.append(node)
+        node = min(dep for dep in edges[node] if dep in names)
+    return path[seen[node]:] + [node]
+
+def order(recipes):
+    """
+    Take (recipe, parsed) pairs and return (recipe, statement) pairs
+    with every module after the modules it depends on. Modules keep
+    their original order unless a dependency forces them to move.
+    """
+    statements = [(recipe, statement) for recipe, parsed in recipes for statement in parsed]
+    index = {}
+    for i, (_, statement) in enumerate(statements):
+        if isinstance(statement, Module) and 'name' in statement.arguments:
+            index.setdefault(statement.arguments['name'], i)
+
+    edges = {}
+    users = {i: [] for i in range(len(statements))}
+    pending = {}
+    for i, (_, statement) in enumerate(statements):
+        deps = set()
+        if isinstance(statement, Module):
+            deps = {index[dep] for dep in module_deps(statement.arguments) if dep in index} - {i}
+        edges[i] = deps
+        pending[i] = len(deps)
+        for dep in deps:
+            users[dep].append(i)
+
+    ready = [i for i, count in pending.items() if count == 0]
+    heapq.heapify(ready)
+    result = []
+    while ready:
+        i = heapq.heappop(ready)
+        result.append(statements[i])
+        for user in users[i]:
+            pending[user] -= 1
+            if pending[user] == 0:
+                heapq.heappush(ready, user)
+
+    if len(result) < len(statements):
+        left = {i for i, count in pending.items() if count}
+        cycle = find_cycle(left, edges)
+        raise CycleError([statements[i][1].arguments['name'] for i in cycle])
+    return result
+
+def levels(statements):
+    """
+    Return the depth of each of the statements, which have to be in
+    the order returned by order(): a module only depends on modules
+    with a smaller depth, so modules with the same one are independent.
+    """
+    level = {}
+    result = []
+    for _, statement in statements:
+        depth = 0
+        if isinstance(statement, Module):
+            depth = max((level[dep] + 1 for dep in module_deps(statement.arguments) if dep in level), default=0)
+            if 'name' in statement.arguments:
+                level.setdefault(statement.arguments['name'], depth)
+        result.append(depth)
+    return result
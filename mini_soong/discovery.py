@@ -0,0 +1,151 @@
+# Recipe discovery
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Walks the tree with os.scandir, never descending into directories that
+# can't contain recipes we want: hidden ones (.git, .pc, ...), the build
+# output and Debian packaging directories at the top level, and anything
+# listed in the ignore file. A recipe declaring subdirs or
+# optional_subdirs limits the walk below its directory to those.
+
+import glob
+import os
+import re
+import sys
+from fnmatch import fnmatch
+from pathlib import Path
+from . import trace
+
+ignore_file = '.mini-soong-ignore'
+
+top_level_ignored = ['out', 'debian']
+
+subdirs_re = re.compile(rb'^\s*(optional_)?subdirs\s*=\s*(\[[^\]]*\])', re.MULTILINE)
+
+def read_ignore_file(root: str):
+    try:
+        with open(os.path.join(root, ignore_file)) as f:
+            lines = [line.strip() for line in f]
+    except OSError:
+        return []
+    return [line.strip('/') for line in lines if line and not line.startswith('#')]
+
+class Walker:
+    def __init__(self, root: str = '.', name: str = 'Android.bp'):
+        self.root = root
+        self.name = name
+        self.ignored = read_ignore_file(root)
+
+    def is_ignored(self, relpath: str, name: str) -> bool:
+        if name.startswith('.'):
+            return True
+        if '/' not in relpath and name in top_level_ignored:
+            return True
+        for pattern in self.ignored:
+            if fnmatch(relpath if '/' in pattern else name, pattern):
+                return True
+        return False
+
+    def relpath(self, path: str) -> str:
+        prefix = f"{self.root.rstrip('/')}/"
+        return path[len(prefix):] if path.startswith(prefix) else path
+
+    def declared_subdirs(self, directory: str, recipe: str):
+        try:
+            with open(recipe, 'rb') as f:
+                text = f.read()
+        except OSError:
+            return None
+        if b'subdirs' not in text:
+            return None
+        from . import blueprint
+        subdirs = None
+        for m in subdirs_re.finditer(text):
+            scope = {}
+            try:
+                blueprint.parse(f"subdirs = {m.group(2).decode()}", scope)
+            except (blueprint.ParseError, UnicodeDecodeError):
+                continue
+            optional = m.group(1) is not None
+            subdirs = (subdirs or []) + [(pattern, optional) for pattern in scope['subdirs']]
+        return subdirs
+
+    def expand_subdirs(self, directory: str, subdirs):
+        children = []
+        for pattern, optional in subdirs:
+            trace.count('scandir')
+            matches = sorted(glob.glob(os.path.join(glob.escape(directory), pattern)))
+            trace.count('stat', len(matches))
+            dirs = [m for m in matches if os.path.isdir(m)]
+            if not dirs and not optional:
+                print(f"WARNING: {directory}: no directories match subdirs entry {pattern}", file=sys.stderr)
+            children += dirs
+        return children
+
+    def scan(self, directory: str):
+        recipes = []
+        children = []
+        trace.count('scandir')
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not self.is_ignored(self.relpath(entry.path), entry.name):
+                            children.append(entry.path)
+                    elif fnmatch(entry.name, self.name) and entry.is_file():
+                        recipes.append(entry.path)
+        except OSError:
+            return [], []
+        for recipe in recipes:
+            subdirs = self.declared_subdirs(directory, recipe)
+            if subdirs is not None:
+                children = [child for child in self.expand_subdirs(directory, subdirs)
+                            if not self.is_ignored(self.relpath(child), os.path.basename(child))]
+        return recipes, children
+
+    def walk(self, threads: int = 1):
+        found = []
+        if threads > 1:
+            from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                pending = {pool.submit(self.scan, self.root)}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        recipes, children = future.result()
+                        found += recipes
+                        pending |= {pool.submit(self.scan, child) for child in children}
+        else:
+            queue = [self.root]
+            while queue:
+                recipes, children = self.scan(queue.pop())
+                found += recipes
+                queue += children
+        return sorted(Path(self.relpath(recipe)) for recipe in found)
+
+def find_recipes(pattern: str, threads: int = 1):
+    if pattern.startswith('**/') and '/' not in pattern[3:]:
+        return Walker('.', pattern[3:]).walk(threads)
+    # anything fancier than a file name anywhere in the tree
+    return sorted([path for path in Path('.').glob(pattern) if not path.parts[0].startswith('.')])
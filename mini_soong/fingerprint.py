@@ -0,0 +1,89 @@
+# Input fingerprints
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Everything the generated build file depends on goes into one digest,
+# which is stored next to the build file. When nothing has changed,
+# mini-soong can stop before doing any real work.
+
+import hashlib
+import os
+from functools import lru_cache
+from pathlib import Path
+
+# the compilers decide which flags ThinLTO gets
+environment = ['DEB_HOST_ARCH', 'DEB_HOST_MULTIARCH', 'CC', 'CXX']
+
+debian_files = ['debian/control', 'debian/changelog']
+
+def stamp_file(output: str) -> Path:
+    return Path(f"{output}.fingerprint")
+
+def inputs(recipes):
+    return [str(recipe) for recipe in recipes] + [f for f in debian_files if Path(f).exists()]
+
+@lru_cache(maxsize=None)
+def package_digest() -> str:
+    # the installed version number doesn't change often enough to rely on
+    h = hashlib.sha256()
+    package = Path(__file__).parent
+    for source in sorted(package.rglob('*.py')):
+        h.update(str(source.relative_to(package)).encode())
+        h.update(source.read_bytes())
+    return h.hexdigest()
+
+def settings(values) -> str:
+    """
+    Digest everything the output depends on except the recipes.
+    """
+    h = hashlib.sha256()
+    h.update(package_digest().encode())
+    for value in values:
+        h.update(b'\0' + value.encode())
+    for var in environment:
+        h.update(f"\0{var}={os.environ.get(var, '')}".encode())
+    for path in debian_files:
+        if Path(path).exists():
+            h.update(b'\0' + path.encode() + b'\0')
+            h.update(Path(path).read_bytes())
+    return h.hexdigest()
+
+def fingerprint(recipes, values) -> str:
+    h = hashlib.sha256()
+    h.update(settings(values).encode())
+    for recipe in recipes:
+        h.update(b'\0' + str(recipe).encode() + b'\0')
+        h.update(Path(recipe).read_bytes())
+    return h.hexdigest()
+
+def up_to_date(output: str, digest: str) -> bool:
+    stamp = stamp_file(output)
+    try:
+        return Path(output).exists() and stamp.read_text().split()[-1] == digest
+    except (OSError, IndexError):
+        return False
+
+def record(output: str, digest: str):
+    # the stamp doubles as a makefile the generated Makefile includes
+    stamp_file(output).write_text(f"# mini-soong input fingerprint {digest}\n")
@@ -0,0 +1,95 @@
+# Build file fragments
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# Instead of one large build file, the modules of each recipe can be
+# written to a file of their own, which the top-level build file then
+# includes. A fragment is only written when it changed, so after a
+# recipe is edited, only its fragment and those of the modules using
+# its modules get a new timestamp.
+
+import os
+from pathlib import Path
+from . import trace
+
+# the fragments written last time, so that only those are ever removed:
+# the directory may well hold build files which aren't mini-soong's
+manifest_file = '.mini-soong-fragments'
+
+def fragment_path(directory: str, recipe: Path, suffix: str) -> Path:
+    return Path(directory, recipe).with_suffix(suffix)
+
+def read_manifest(directory: str) -> list:
+    try:
+        with open(Path(directory, manifest_file)) as f:
+            return [Path(directory, line.rstrip('\n')) for line in f if line.strip()]
+    except OSError:
+        return []
+
+def write_manifest(directory: str, paths):
+    manifest = Path(directory, manifest_file)
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = manifest.with_name(f"{manifest.name}.{os.getpid()}")
+    tmp.write_text(''.join(f"{path.relative_to(directory)}\n" for path in paths))
+    os.replace(tmp, manifest)
+
+def write(directory: str, ordered, fragments, suffix: str = '.mk'):
+    """
+    Write the fragments of the statements to a file per recipe, remove
+    those written before for recipes which are gone, and return the
+    paths in the order the recipes first appear in.
+    """
+    texts = dict()
+    for (recipe, _), fragment in zip(ordered, fragments):
+        texts.setdefault(fragment_path(directory, recipe, suffix), []).append(fragment)
+
+    written = read_manifest(directory)
+    for path in texts:
+        if path not in written and path.exists():
+            raise FileExistsError(f"{path} wasn't written by mini-soong, not replacing it")
+
+    for path, parts in texts.items():
+        text = ''.join(parts)
+        try:
+            if path.read_text() == text:
+                continue
+        except OSError:
+            pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}")
+        tmp.write_text(text)
+        os.replace(tmp, path)
+        trace.count('fragments written')
+
+    for path in written:
+        if path not in texts:
+            try:
+                path.unlink()
+                trace.count('fragments removed')
+            except FileNotFoundError:
+                pass
+    write_manifest(directory, texts)
+
+    return list(texts)
@@ -0,0 +1,223 @@
+# Benchmarks of the generation itself
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# mini-soong genbench writes a synthetic tree of recipes of the size
+# asked for and runs mini-soong on it a few times, each in a process of
+# its own, taking the time of each phase from its trace and the peak
+# memory use from the kernel. Host architecture values are stubbed and
+# all libraries are built in the tree, so nothing outside of it is run
+# or looked at, and the results can be compared across machines only
+# as far as their speed goes.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .startup import entry
+
+# instead of asking dpkg-architecture
+stub_environment = {
+    'DEB_HOST_ARCH': 'amd64',
+    'DEB_HOST_MULTIARCH': 'x86_64-linux-gnu',
+    'CPPFLAGS': '',
+    'CFLAGS': '-O2',
+    'CXXFLAGS': '-O2',
+    'LDFLAGS': '',
+}
+
+# the phases reported and the spans of mini-soong they're made of
+phases = {
+    'discovery': ['discover'],
+    'parsing': ['parse'],
+    'evaluation': ['index', 'generate'],
+    'emission': ['write'],
+}
+
+archs = ['x86_64', 'arm64', 'x86', 'arm', 'riscv64', 'mips64', 'mips']
+
+# recipes per directory, so the tree has a few levels
+fanout = 16
+
+module_types = ['cc_library_shared', 'cc_library_static', 'cc_library', 'cc_binary']
+
+def quote(values) -> str:
+    return f"[{', '.join(json.dumps(v) for v in values)}]"
+
+def arch_blocks(name: str, arch: int) -> str:
+    if not arch:
+        return ''
+    variants = ', '.join(f'{a}: {{ cflags: ["-DARCH_{a.upper()}"], srcs: ["{name}_{a}.c"] }}' for a in archs[:arch])
+    return (f", arch: {{ {variants} }}"
+            f", multilib: {{ lib32: {{ cflags: [\"-DLIB32\"] }}, lib64: {{ cflags: [\"-DLIB64\"] }} }}"
+            f", target: {{ linux_glibc: {{ cflags: [\"-DGLIBC\"] }} }}")
+
+def recipe(i: int, modules: int, defaults: int, arch: int) -> str:
+    """
+    Return the text of the i-th recipe: a chain of defaults, each using
+    the one before, and modules using the last of it, linking to the
+    first library of a couple of earlier recipes. Only what the
+    pyparsing grammar accepts too is used, e.g. variables are only
+    added to other variables.
+    """
+    lines = [f'r{i}_flags = ["-DRECIPE={i}"]']
+    chain = 'top_defaults'
+    for d in range(defaults):
+        name = f"r{i}_defaults{d}"
+        lines.append(f'r{i}_level{d} = ["-DLEVEL={d}"]')
+        lines.append(f'cc_defaults {{ name: "{name}", defaults: ["{chain}"], cflags: r{i}_level{d} + r{i}_flags{arch_blocks(name, arch)} }}')
+        chain = name
+    for m in range(modules):
+        kind = module_types[m % len(module_types)]
+        name = f"{'bin' if kind == 'cc_binary' else 'lib'}{i}_{m}"
+        srcs = [f"{name}_{n}.c" for n in range(4)]
+        props = [f'name: "{name}"', f'defaults: ["{chain}"]', f"srcs: {quote(srcs)}", 'export_include_dirs: ["include"]']
+        shared = [f"lib{k}_0" for k in sorted({i - 1, i // 2}) if 0 <= k < i]
+        if m > 0 and kind != 'cc_library_shared':
+            shared.append(f"lib{i}_0")
+        if shared:
+            props.append(f"shared_libs: {quote(shared)}")
+        if m > 1 and kind in ('cc_library_shared', 'cc_binary'):
+            props.append(f'static_libs: ["lib{i}_1"]')
+        lines.append(f"{kind} {{ {', '.join(props)}{arch_blocks(name, arch)} }}")
+    return '\n'.join(lines) + '\n'
+
+def write_corpus(root: Path, recipes: int, modules: int, defaults: int, arch: int):
+    root.mkdir(parents=True, exist_ok=True)
+    (root / 'Android.bp').write_text('common_flags = ["-Wall"]\ncc_defaults { name: "top_defaults", cflags: common_flags }\n')
+    for i in range(recipes):
+        directory = root / f"d{i // fanout}" / f"r{i}"
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / 'Android.bp').write_text(recipe(i, modules, defaults, arch))
+
+def run_once(root: Path, backend: str, jobs: int, parser: str) -> dict:
+    """
+    Run mini-soong on the tree, returning the time of each phase and the
+    whole run in milliseconds, and its peak memory use in KiB.
+    """
+    package_root = str(Path(__file__).resolve().parents[1])
+    pythonpath = [package_root] + ([os.environ['PYTHONPATH']] if 'PYTHONPATH' in os.environ else [])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(pythonpath), **stub_environment)
+    trace_file = root / 'genbench-trace.json'
+    argv = ['--force', '--no-cache', '--jobs', str(jobs), '--backend', backend, '--parser', parser,
+            '--trace', str(trace_file), '-o', str(root / f"genbench.{backend}")]
+    begin = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', entry] + argv, cwd=root, env=env, stdout=subprocess.DEVNULL)
+    # unlike getrusage(), this only covers that one process
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = (time.perf_counter() - begin) * 1000
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    if proc.returncode:
+        raise RuntimeError(f"mini-soong exited with {proc.returncode}")
+    with open(trace_file) as f:
+        events = json.load(f)['traceEvents']
+    spans = dict()
+    for event in events:
+        if event['cat'] == 'phase' and event['pid'] == proc.pid:
+            spans[event['name']] = spans.get(event['name'], 0) + event['dur'] / 1000
+    result = {phase: sum(spans.get(name, 0) for name in names) for phase, names in phases.items()}
+    result['total'] = elapsed
+    result['peak_rss'] = usage.ru_maxrss
+    return result
+
+def measure(root: Path, runs: int, backend: str, jobs: int, parser: str) -> dict:
+    results = [run_once(root, backend, jobs, parser) for _ in range(runs)]
+    times = {name: round(statistics.median(r[name] for r in results), 3) for name in [*phases, 'total']}
+    return {'phases': times, 'peak_rss': max(r['peak_rss'] for r in results)}
+
+def compare(current: dict, baseline: dict, threshold: float, file=sys.stdout) -> float:
+    """
+    Print the results, with the change against the baseline, and
+    return the largest slowdown or growth in percent.
+    """
+    worst = 0.0
+    if baseline and baseline.get('corpus') != current['corpus']:
+        print("warning: the baseline was measured on a different corpus", file=file)
+    rows = [(name, value, (baseline or {}).get('phases', {}).get(name), 'ms') for name, value in current['phases'].items()]
+    rows.append(('peak memory', current['peak_rss'] / 1024, (baseline or {}).get('peak_rss', 0) / 1024 or None, 'MiB'))
+    for name, value, before, unit in rows:
+        line = f"  {name:<14} {value:10.1f} {unit:<3}"
+        if before:
+            change = (value - before) / before * 100
+            worst = max(worst, change)
+            mark = ' worse' if change > threshold else ' better' if change < -threshold else ''
+            line += f"  {before:10.1f} {unit:<3}  {change:+6.1f}%{mark}"
+        print(line.rstrip(), file=file)
+    return worst
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(prog='mini-soong genbench', description='Time generating the build file for a synthetic tree of recipes')
+    parser.add_argument('--recipes', metavar='N', type=int, default=200, help='number of recipes (default: 200)')
+    parser.add_argument('--modules', metavar='N', type=int, default=8, help='modules per recipe (default: 8)')
+    parser.add_argument('--defaults', metavar='N', type=int, default=2, help='length of the chain of defaults in each recipe (default: 2)')
+    parser.add_argument('--arch', metavar='N', type=int, default=2, help=f'architectures with arch blocks in each module and defaults, with multilib and target blocks if any (default: 2, at most {len(archs)})')
+    parser.add_argument('--runs', metavar='N', type=int, default=3, help='take the median of N runs (default: 3)')
+    parser.add_argument('--backend', choices=['make', 'ninja'], default='make', help='build file flavour to generate (default: make)')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int, default=1, help='run mini-soong with N processes (default: 1)')
+    parser.add_argument('--parser', choices=['builtin', 'pyparsing'], default='builtin', help='Blueprint parser to use (default: builtin)')
+    parser.add_argument('--tree', metavar='DIR', type=str, help='write the tree to DIR and keep it, instead of a temporary directory')
+    parser.add_argument('--output', '-o', metavar='FILE', type=str, help='write the results as JSON to FILE')
+    parser.add_argument('--baseline', metavar='FILE', type=str, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', metavar='PCT', type=float, default=5.0, help='changes smaller than this are noise (default: 5)')
+    parser.add_argument('--fail-above', metavar='PCT', type=float, help='fail if any phase got slower, or the memory use grew, by more than this')
+    args = parser.parse_args(argv)
+
+    corpus = {
+        'recipes': args.recipes,
+        'modules': args.modules,
+        'defaults': args.defaults,
+        'arch': min(args.arch, len(archs)),
+        'backend': args.backend,
+        'jobs': args.jobs,
+        'parser': args.parser,
+    }
+    try:
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        with tempfile.TemporaryDirectory(prefix='mini-soong-genbench-') as tmp:
+            root = Path(args.tree or tmp).resolve()
+            write_corpus(root, args.recipes, args.modules, args.defaults, corpus['arch'])
+            results = {'corpus': corpus, 'runs': args.runs, **measure(root, args.runs, args.backend, args.jobs, args.parser)}
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{args.recipes} recipes, {args.recipes * args.modules} modules, median of {args.runs} runs:")
+    worst = compare(results, baseline, args.threshold)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    if args.fail_above is not None and worst > args.fail_above:
+        print(f"ERROR: generation got {worst:.1f}% worse", file=sys.stderr)
+        return 1
+    return 0
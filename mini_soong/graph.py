@@ -0,0 +1,261 @@
+# Build graph
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# Builders describe variables, rules and build edges to the writer,
+# which records them as nodes in the order they came. The backends
+# subclass Graph with a way to refer to variables and to turn each kind
+# of node into their syntax, and write the whole graph out when closed.
+# There are as many nodes as build edges and then some, so they keep
+# their fields in slots, and values are joined as they're recorded.
+#
+# The nodes of a module are turned into text by the process which
+# generated them, and only kept for the whole tree when the graph is
+# dumped as JSON, for tools which would rather not parse Makefiles.
+
+import json
+import sys
+from . import trace
+
+def join(value) -> str:
+    if isinstance(value, str):
+        return value
+    return ' '.join(v for v in value if v)
+
+class Node:
+    __slots__ = ()
+    kind = None
+
+    def to_json(self) -> dict:
+        return {'kind': self.kind, **{name: getattr(self, name) for name in self.__slots__}}
+
+class Text(Node):
+    __slots__ = ('text',)
+    kind = 'text'
+
+    def __init__(self, text):
+        self.text = text
+
+class Blank(Node):
+    __slots__ = ()
+    kind = 'blank'
+
+class Comment(Node):
+    __slots__ = ('text',)
+    kind = 'comment'
+
+    def __init__(self, text):
+        self.text = text
+
+class Include(Node):
+    __slots__ = ('path',)
+    kind = 'include'
+
+    def __init__(self, path):
+        self.path = path
+
+class Variable(Node):
+    __slots__ = ('name', 'value', 'weak', 'append', 'align')
+    kind = 'variable'
+
+    # align is the width backends which line variables up pad the name to
+    def __init__(self, name, value, weak, append, align=0):
+        self.name = name
+        self.value = value
+        self.weak = weak
+        self.append = append
+        self.align = align
+
+class Soversion(Node):
+    __slots__ = ('name', 'version')
+    kind = 'soversion'
+
+    def __init__(self, name, version):
+        self.name = name
+        self.version = version
+
+class BuildFlags(Node):
+    __slots__ = ()
+    kind = 'buildflags'
+
+class BuildDir(Node):
+    __slots__ = ('path',)
+    kind = 'builddir'
+
+    def __init__(self, path):
+        self.path = path
+
+class Rule(Node):
+    __slots__ = ('name', 'commands', 'deps', 'description', 'restat', 'generator', 'jobserver')
+    kind = 'rule'
+
+    def __init__(self, name, commands, deps, description, restat, generator, jobserver):
+        self.name = name
+        self.commands = commands
+        self.deps = deps
+        self.description = description
+        self.restat = restat
+        self.generator = generator
+        self.jobserver = jobserver
+
+class Build(Node):
+    __slots__ = ('outputs', 'rule', 'inputs', 'implicit', 'order_only', 'variables', 'phony')
+    kind = 'build'
+
+    # phony edges run their command every time, and never write their outputs
+    def __init__(self, outputs, rule, inputs, implicit, order_only, variables, phony=False):
+        self.outputs = outputs
+        self.rule = rule
+        self.inputs = inputs
+        self.implicit = implicit
+        self.order_only = order_only
+        self.variables = variables
+        self.phony = phony
+
+class Phony(Node):
+    __slots__ = ('name', 'deps')
+    kind = 'phony'
+
+    def __init__(self, name, deps):
+        self.name = name
+        self.deps = deps
+
+class Regenerate(Node):
+    __slots__ = ('output', 'stamp', 'inputs', 'args')
+    kind = 'regenerate'
+
+    def __init__(self, output, stamp, inputs, args):
+        self.output = output
+        self.stamp = stamp
+        self.inputs = inputs
+        self.args = args
+
+class Default(Node):
+    __slots__ = ('target',)
+    kind = 'default'
+
+    def __init__(self, target):
+        self.target = target
+
+kinds = {cls.kind: cls for cls in Node.__subclasses__()}
+
+def dump(nodes, output):
+    """
+    Write the graph as JSON, leaving out the blank lines.
+    """
+    json.dump({'nodes': [node.to_json() for node in nodes if node.kind != 'blank']}, output, indent=1)
+    output.write('\n')
+
+class Graph:
+    def __init__(self, output):
+        self.output = output
+        self.nodes = list()
+        # backends look commands up when writing edges out
+        self.rules = dict()
+        self.writers = {kind: getattr(self, f"write_{kind}") for kind in kinds}
+
+    def verbatim(self, text: str):
+        self.nodes.append(Text(text))
+
+    def newline(self):
+        self.nodes.append(Blank())
+
+    def comment(self, text: str):
+        self.nodes.append(Comment(text))
+
+    def include(self, path: str):
+        self.nodes.append(Include(path))
+
+    def variable(self, name: str, value, weak: bool = False, append: bool = False, align: int = 0):
+        self.nodes.append(Variable(name, join(value), weak, append, align))
+
+    def soversion(self, name: str, version: str):
+        self.nodes.append(Soversion(name, version))
+
+    def buildflags(self):
+        self.nodes.append(BuildFlags())
+
+    def builddir(self, path: str):
+        self.nodes.append(BuildDir(path))
+
+    def rule(self, name: str, command, deps: str = None, description: str = None, restat: bool = False, generator: bool = False, jobserver: bool = False):
+        trace.count('rules')
+        command = [command] if isinstance(command, str) else command
+        self.rules[name] = rule = Rule(name, tuple(command), deps, description, restat, generator, jobserver)
+        self.nodes.append(rule)
+
+    def build(self, outputs, rule: str, inputs=(), implicit=(), order_only=(), variables=None, phony: bool = False):
+        trace.count('edges')
+        # the same flags and paths come up again and again
+        variables = {name: sys.intern(join(value)) for name, value in (variables or {}).items()}
+        self.nodes.append(Build(tuple(outputs), rule, tuple(inputs), tuple(implicit), tuple(order_only), variables, phony))
+
+    def phony(self, name: str, deps=()):
+        trace.count('edges')
+        self.nodes.append(Phony(name, tuple(deps)))
+
+    def regenerate(self, output: str, stamp: str, inputs, args: str):
+        self.nodes.append(Regenerate(output, str(stamp), tuple(inputs), args))
+
+    def default(self, target: str):
+        self.nodes.append(Default(target))
+
+    def write_text(self, node):
+        if node.text:
+            yield node.text[:-1]
+
+    def write_blank(self, node):
+        yield ''
+
+    def write_comment(self, node):
+        yield f"# {node.text}"
+
+    def write_include(self, node):
+        yield f"include {node.path}"
+
+    def text(self, nodes) -> str:
+        """
+        Return the nodes in the syntax of the backend.
+        """
+        lines = []
+        for node in nodes:
+            lines.extend(self.writers[node.kind](node))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def close(self):
+        # the fragments of the modules are text already and go out as
+        # they are; the output is buffered, so there are few writes
+        # either way
+        pending = []
+        for node in self.nodes:
+            if node.kind == 'text':
+                self.output.write(self.text(pending))
+                self.output.write(node.text)
+                pending = []
+            else:
+                pending.append(node)
+        self.output.write(self.text(pending))
+        self.output.flush()
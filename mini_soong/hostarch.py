@@ -0,0 +1,91 @@
+# Host architecture lookup
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Running dpkg-architecture takes longer than the rest of a small
+# configure run, so its answers are kept in the cache directory. They
+# only change with dpkg itself or with the DEB_* and DPKG_* variables
+# it reads, so those make up the key.
+
+import hashlib
+import json
+import os
+import shutil
+from functools import lru_cache
+from pathlib import Path
+from .model import options
+from . import trace
+
+cache_file = 'dpkg-architecture.json'
+
+def cache_key() -> str:
+    h = hashlib.sha256()
+    for tool in ['dpkg-architecture', 'dpkg']:
+        path = shutil.which(tool)
+        if path:
+            trace.count('stat')
+            h.update(f"{path}:{os.stat(path).st_mtime_ns}\0".encode())
+    for name in sorted(os.environ):
+        if name.startswith(('DEB_', 'DPKG_')):
+            h.update(f"{name}={os.environ[name]}\0".encode())
+    return h.hexdigest()
+
+def query() -> dict:
+    import sh
+    output = sh.Command('dpkg-architecture')()
+    return dict(line.split('=', 1) for line in output.splitlines() if '=' in line)
+
+@lru_cache(maxsize=None)
+def values() -> dict:
+    cache_dir = options.get('cache_dir')
+    if not cache_dir:
+        return query()
+    path = Path(cache_dir) / cache_file
+    key = cache_key()
+    try:
+        with path.open() as f:
+            data = json.load(f)
+        if data['key'] == key:
+            return data['values']
+    except (OSError, ValueError, KeyError):
+        pass
+    result = query()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{cache_file}.{os.getpid()}")
+        with tmp.open('w') as f:
+            json.dump({'key': key, 'values': result}, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return result
+
+def host(variable: str) -> str:
+    """
+    Return the value of a dpkg-architecture variable, e.g. DEB_HOST_ARCH,
+    preferring the environment.
+    """
+    if variable in os.environ:
+        return os.environ[variable]
+    return values()[variable]
@@ -0,0 +1,58 @@
+# Library lookup
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Library directories are listed once, the first time a library is
+# looked up in them, instead of checking every library of every
+# module with a stat() of its own, which is slow on network file
+# systems. Processes forked later get the listings made so far.
+
+import os
+from pathlib import Path
+from . import trace
+
+class LibraryIndex:
+    def __init__(self, dirs):
+        self.dirs = [Path(d) for d in dirs]
+        self.listings = dict()
+
+    def listing(self, path: Path) -> set:
+        if path not in self.listings:
+            trace.count('scandir')
+            try:
+                with os.scandir(path) as it:
+                    self.listings[path] = {entry.name for entry in it}
+            except OSError:
+                self.listings[path] = set()
+        return self.listings[path]
+
+    def find(self, fname: str):
+        """
+        Return the path of the first file named fname in the search
+        directories, or None.
+        """
+        for path in self.dirs:
+            if fname in self.listing(path):
+                return path / fname
+        return None
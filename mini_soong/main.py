@@ -23,51 +23,243 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from .parser import soong
-from .model import defaults, all_targets, all_modules, current_recipe, Module
+from .cache import ParseCache, default_dir, default_size
+from . import fingerprint
+from . import fragments
+from . import trace
+from .discovery import find_recipes
+from .model import defaults, all_targets, all_modules, current_recipe, options, Module
 from .utils import mergedefaults, print_vars
-from .builders import flag_defaults, extra_targets
+from .builders import flag_defaults, clean_targets, extra_targets, builders
+from . import backends
 import argparse
+import atexit
+import hashlib
 import os
+import shlex
 from pathlib import Path
 
+# mini-soong report etc. are handled by the main() of these modules
+subcommands = {
+    'report': 'timing',
+    'bench-report': 'bench',
+    'test-report': 'testresults',
+    'genbench': 'genbench',
+}
+
+# options with no effect on what's generated
+neutral_options = ['help', 'force', 'jobs', 'scan_threads', 'cache', 'cache_dir', 'cache_size', 'trace', 'stats', 'startup_profile']
+
+def build_args(parser, args) -> list:
+    """
+    Return the command line regenerating the output, with the options
+    as they were resolved, those taken from the environment included,
+    and without those which don't change what's generated.
+    """
+    argv = []
+    for action in parser._actions:
+        value = getattr(args, action.dest, None)
+        if action.dest in neutral_options or value is None:
+            continue
+        if not action.option_strings:
+            argv.append(value)
+        elif isinstance(action, (argparse._StoreTrueAction, argparse._StoreFalseAction)):
+            if value != action.default:
+                argv.append(action.option_strings[0])
+        elif isinstance(action, argparse._AppendAction):
+            argv += [f"{action.option_strings[0]}={v}" for v in value]
+        else:
+            argv.append(f"{action.option_strings[0]}={value}")
+    return argv
+
 def run():
     import sys
     global all_modules, current_recipe
 
+    if len(sys.argv) > 1 and sys.argv[1] in subcommands:
+        import importlib
+        sys.exit(importlib.import_module(f".{subcommands[sys.argv[1]]}", __package__).main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser(description='Convert Soong recipes to a Makefile')
     parser.add_argument('bp', metavar='RECIPES', type=str, default='**/Android.bp', nargs='?', help='pattern used to find recipes')
     parser.add_argument('poutput', metavar='OUTPUT', type=str, nargs='?', help='where to write the Makefile (default: stdout)')
     parser.add_argument('--output', '-o', metavar='OUTPUT', type=str, help='where to write the Makefile (default: stdout)')
+    parser.add_argument('--force', '-f', action='store_true', help='regenerate the output even if none of the inputs changed')
+    parser.add_argument('--out-dir', metavar='DIR', type=str, default='.', help='where to put objects, libraries and binaries (default: .)')
+    parser.add_argument('--mirror-recipes', action='store_true', help='put libraries and binaries in directories mirroring those of their recipes under the output directory')
+    parser.add_argument('--fragments', metavar='DIR', type=str, help='write the modules of each recipe to a Makefile of its own under DIR, only regenerating those which changed')
+    parser.add_argument('--no-per-object', dest='per_object', action='store_false', help='compile all sources of a linked module in a single compiler call')
+    parser.add_argument('--unity', action='store_true', help='compile the sources of each module in batches included into one file')
+    parser.add_argument('--unity-batch', metavar='N', type=int, default=8, help='how many sources to put in one unity batch (default: 8)')
+    parser.add_argument('--backend', choices=backends.backends, default=os.environ.get('MINI_SOONG_BACKEND', 'make'), help='build file flavour to generate (default: make, or $MINI_SOONG_BACKEND)')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int, default=os.cpu_count(), help='parse recipes and generate modules in N processes (default: number of CPUs)')
+    parser.add_argument('--compiler-launcher', metavar='CMD', type=str, default=os.environ.get('MINI_SOONG_COMPILER_LAUNCHER'), help='run every compile through CMD, e.g. ccache (default: $MINI_SOONG_COMPILER_LAUNCHER)')
+    parser.add_argument('--linker', choices=['bfd', 'gold', 'lld', 'mold'], default=os.environ.get('MINI_SOONG_LINKER'), help='link with this linker instead of the default one (default: $MINI_SOONG_LINKER)')
+    parser.add_argument('--lto', choices=['thin', 'full'], default=os.environ.get('MINI_SOONG_LTO'), help='compile and link with link time optimisation (default: $MINI_SOONG_LTO)')
+    parser.add_argument('--library-path', '-L', metavar='DIR', action='append', default=[], help='look for external libraries in DIR before the system directories')
+    parser.add_argument('--sysroot', metavar='DIR', type=str, help='look for system libraries under DIR instead of /')
+    parser.add_argument('--scan-threads', metavar='N', type=int, default=1, help='look for recipes using N threads (default: 1)')
+    parser.add_argument('--parser', choices=['builtin', 'pyparsing'], default='builtin', help='Blueprint parser to use (default: builtin)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='never use the parse or host architecture caches')
+    parser.add_argument('--cache-dir', metavar='DIR', type=str, default=os.environ.get('MINI_SOONG_CACHE_DIR', default_dir), help=f'where to keep parsed recipes (default: {default_dir}, or $MINI_SOONG_CACHE_DIR)')
+    parser.add_argument('--cache-size', metavar='MIB', type=int, default=default_size, help=f'evict the least recently used entries above this size (default: {default_size})')
+    parser.add_argument('--startup-profile', action='store_true', help='run with import timing on and report the time taken by each module')
+    parser.add_argument('--time-log', metavar='FILE', type=str, help='make the generated build file log how long each compile and link took to FILE, see mini-soong report')
+    parser.add_argument('--trace', metavar='FILE', type=str, help='write a Chrome trace of the phases, recipes and modules to FILE')
+    parser.add_argument('--stats', action='store_true', help='print counts and timings when done')
+    parser.add_argument('--dump-graph', choices=['json'], help='write the build graph in this format instead of a build file')
+    parser.add_argument('--define', '-D', metavar='NAME=VALUE', action='append', default=[], help='set a build file variable, e.g. prefix or libdir')
     args = parser.parse_args()
 
+    if args.startup_profile:
+        from . import startup
+        sys.exit(startup.profile([arg for arg in sys.argv[1:] if arg != '--startup-profile']))
+
     bp = args.bp
     output = args.poutput or args.output
+    argv = build_args(parser, args)
+    # the fingerprint covers what the backend bakes in besides the options
+    settings = [f"{name}={value}" for name, value in sorted(vars(args).items()) if name not in neutral_options]
+    settings += backends.settings(args.backend)
+
+    if args.fragments and not (output and args.backend == 'make'):
+        sys.exit("ERROR: --fragments needs an output file and the make backend")
+    if args.fragments and args.dump_graph:
+        sys.exit("ERROR: --fragments and --dump-graph can't be used together")
+
+    if args.trace or args.stats:
+        trace.enable()
+
+    def report():
+        if args.trace:
+            trace.write(args.trace)
+        if args.stats:
+            trace.summary()
+
+    options.update({
+        'per_object': args.per_object,
+        'unity': args.unity_batch if args.unity else 0,
+        'output': output,
+        'out_dir': args.out_dir,
+        'mirror_recipes': args.mirror_recipes,
+        'library_path': args.library_path,
+        'sysroot': args.sysroot,
+        'time_log': args.time_log,
+        'compiler_launcher': args.compiler_launcher,
+        'linker': args.linker,
+        'lto': args.lto,
+        'cache_dir': args.cache_dir if args.cache else None,
+    })
+
+    # todo: allow chdir
+    with trace.span('discover'):
+        recipes = find_recipes(bp, args.scan_threads)
+    trace.count('recipes', len(recipes))
 
     if output:
-        sys.stdout = open(output, 'w')
+        with trace.span('fingerprint'):
+            digest = fingerprint.fingerprint(recipes, settings)
+            current = fingerprint.up_to_date(output, digest)
+        if not args.force and current:
+            fingerprint.record(output, digest)
+            report()
+            return
+
+    # not needed when the output is up to date, so only imported now
+    from . import blueprint
+    from . import depgraph
+    from . import graph
+    from . import pipeline
+
+    # written out in a few large chunks, to a file which only replaces
+    # the output once it's complete: an error further on mustn't leave
+    # an empty build file behind which the fingerprint says is current
+    if output:
+        partial = Path(output).with_name(f".{Path(output).name}.{os.getpid()}")
+        atexit.register(partial.unlink, missing_ok=True)
+        out = open(partial, 'w', buffering=1024 * 1024)
+    else:
+        out = sys.stdout
+    w = backends.select(args.backend, out)
+    for define in args.define:
+        name, _, value = define.partition('=')
+        w.variable(name, value)
 
-    flag_defaults()
+    w.builddir(args.out_dir)
     all_modules.clear()
 
-    # todo: allow chdir
-    recipes = sorted([path for path in Path('.').glob(bp) if not path.parts[0].startswith('.')])
-    for recipe in recipes:
-        parsed = soong.parseString(recipe.read_text())
-        all_modules += [r.arguments['name'] for r in parsed if isinstance(r, Module) and 'name' in r.arguments]
-
-        current_recipe.update({
-            'name': str(recipe),
-            'dir': recipe.parents[0],
-            'parsed': parsed
-        })
-        for r in parsed:
-            r.run()
-
-    print(f"build: {' '.join(all_targets)}")
-    if all_targets:
-        clean_targets = [f"clean-{target}" for target in all_targets]
-        print(f"clean: {' '.join(clean_targets)}")
+    if args.parser == 'pyparsing':
+        import pyparsing
+        parser_id = f"pyparsing-{pyparsing.__version__}"
     else:
-        print(f"clean:")
+        parser_id = f"builtin-{blueprint.version}"
+
+    cache = ParseCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache else None
+
+    with trace.span('parse'):
+        parsed_recipes = pipeline.parse_recipes(recipes, args.parser, parser_id, cache, args.jobs)
+    if cache:
+        trace.count('cache hits', cache.hits)
+        trace.count('cache misses', cache.misses)
+
+    with trace.span('index'):
+        for recipe, parsed in parsed_recipes:
+            for r in parsed:
+                if isinstance(r, Module) and 'name' in r.arguments:
+                    all_modules.add(r, recipe)
+        trace.count('modules', len(all_modules))
+
+        # only load the builders for the module types actually used
+        flag_defaults(dict.fromkeys(r.name for _, parsed in parsed_recipes for r in parsed if isinstance(r, Module)))
+
+        try:
+            statements = depgraph.order(parsed_recipes)
+        except depgraph.CycleError as e:
+            sys.exit(f"ERROR: {e}")
+
+    with trace.span('generate'):
+        if args.fragments and cache:
+            # a module whose recipe and dependencies are as they were comes out the same
+            salt = hashlib.sha256(f"{fingerprint.settings(settings)}\0{[b.__name__ for b in builders()]}".encode()).hexdigest()
+            generated = pipeline.generate(statements, parsed_recipes, args.jobs, cache, salt)
+        else:
+            generated = pipeline.generate(statements, parsed_recipes, args.jobs, nodes=bool(args.dump_graph))
+
+    if args.fragments:
+        with trace.span('write'):
+            try:
+                paths = fragments.write(args.fragments, statements, generated)
+            except FileExistsError as e:
+                sys.exit(f"ERROR: {e}")
+            for path in paths:
+                w.include(str(path))
+        w.newline()
+    elif args.dump_graph:
+        for nodes in generated:
+            w.nodes.extend(nodes)
+    else:
+        for text in generated:
+            w.verbatim(text)
+
+    w.phony('build', all_targets)
+    w.phony('clean', [f"clean-{Path(target).name}" for target in all_targets] + clean_targets())
     extra_targets()
+    w.default('build')
+    if output:
+        w.newline()
+        w.regenerate(output, fingerprint.stamp_file(output), fingerprint.inputs(recipes), shlex.join(argv))
+    with trace.span('write'):
+        if args.dump_graph:
+            graph.dump(w.nodes, out)
+        else:
+            w.close()
+
+    if output:
+        out.close()
+        os.replace(partial, output)
+        fingerprint.record(output, digest)
+
+    if cache:
+        cache.evict()
+
+    report()
@@ -26,13 +26,55 @@
 
 from dataclasses import dataclass
 
-all_modules = list()
+class Registry:
+    """
+    Every module of every recipe, looked up by name, with the recipe
+    defining it.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.modules = dict()
+        self.recipes = dict()
+
+    def add(self, module, recipe):
+        name = module.arguments['name']
+        if name in self.modules:
+            import sys
+            print(f"WARNING: {recipe}: module {name} already defined in {self.recipes[name]}", file=sys.stderr)
+            return
+        self.modules[name] = module
+        self.recipes[name] = recipe
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and name in self.modules
+
+    def __iter__(self):
+        return iter(self.modules)
+
+    def __len__(self) -> int:
+        return len(self.modules)
+
+    def get(self, name: str):
+        return self.modules.get(name)
+
+    def recipe_dir(self, name: str):
+        return self.recipes[name].parents[0]
+
+all_modules = Registry()
 all_targets = list()
 
 defaults = dict()
 
 current_recipe = dict()
 
+# containers builders add to as modules are generated; modules generated
+# in another process send what they've added back to the main one
+shared = [all_targets, defaults]
+
+options = dict()
+
 @dataclass
 class Assignment:
     # NOT currently used
@@ -56,10 +98,18 @@ class Module:
         self.name = tokens[0][0]
         self.arguments = tokens[0][1].asDict()
 
+    @classmethod
+    def from_dict(cls, name: str, arguments: dict):
+        module = cls.__new__(cls)
+        module.name = name
+        module.arguments = arguments
+        return module
+
     def run(self):
         from . import builders
-        if self.name in builders.methods:
-            builders.methods[self.name](**self.arguments)
+        method = builders.method(self.name)
+        if method:
+            method(**self.arguments)
         else:
             import sys
             print(f"WARNING: {self.name} not yet supported", file=sys.stderr)
@@ -0,0 +1,253 @@
+# Parallel parsing and generation
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Recipes are parsed by a pool of processes one directory level at a
+# time: as in Soong, a recipe sees the variables of the recipes in the
+# directories above it, so it can only be parsed after them.
+#
+# Modules are generated the same way, one level of the dependency graph
+# at a time, each into a fragment of its own: the text of its part of
+# the build graph, or the nodes themselves when the graph is dumped.
+# The fragments are put together in the order a serial run would write
+# them, and what the builders added to the shared containers is put
+# back in that order as well, so the output doesn't depend on the
+# number of processes.
+#
+# Given a cache, a module whose recipe and dependencies haven't changed
+# isn't generated again: its fragment and what it added to the shared
+# containers are taken from the cache instead.
+
+import hashlib
+import json
+import sys
+from copy import deepcopy
+from . import blueprint
+from . import depgraph
+from . import trace
+from .backends import writer
+from .model import current_recipe, shared, Module
+
+# starting a pool of processes costs about as much as generating fifty
+# modules, so smaller batches are done right away
+min_batch = 100
+
+# what the worker processes work on, inherited when they're forked
+statements = list()
+parsed_recipes = dict()
+keep_nodes = False
+
+def map_jobs(fn, items, jobs: int):
+    if jobs < 2 or len(items) < min_batch:
+        return [fn(item) for item in items]
+    import multiprocessing
+    # forked processes flush inherited buffers when they exit
+    sys.stdout.flush()
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+        chunksize = max(1, len(items) // (jobs * 4))
+        if not trace.enabled:
+            return pool.map(fn, items, chunksize=chunksize)
+        results = pool.map(run_traced, [(fn, item) for item in items], chunksize=chunksize)
+    for _, events, counts in results:
+        trace.merge(events, counts)
+    return [result for result, _, _ in results]
+
+def run_traced(job):
+    fn, item = job
+    before = len(trace.events), dict(trace.counts)
+    result = fn(item)
+    return (result, *trace.changes(*before))
+
+def parse_text(parser: str, text: str, scope: dict):
+    scope = deepcopy(scope)
+    if parser == 'pyparsing':
+        from . import parser as pyparser
+        pyparser.variables.clear()
+        pyparser.variables.update(scope)
+        return list(pyparser.soong.parseString(text)), dict(pyparser.variables)
+    return blueprint.parse(text, scope), scope
+
+def parse_one(item):
+    parser, recipe, text, scope = item
+    try:
+        with trace.span(recipe, 'parse', recipe=recipe):
+            return parse_text(parser, text, scope), None
+    except blueprint.ParseError as e:
+        return None, str(e)
+
+def parent_recipe(recipe, dirs):
+    for parent in list(recipe.parents)[1:]:
+        if parent in dirs:
+            return dirs[parent]
+    return None
+
+def parse_recipes(recipes, parser: str, parser_id: str, cache, jobs: int):
+    dirs = {recipe.parents[0]: recipe for recipe in recipes}
+    parents = {recipe: parent_recipe(recipe, dirs) for recipe in recipes}
+    depth = {}
+    def find_depth(recipe):
+        if recipe not in depth:
+            parent = parents[recipe]
+            depth[recipe] = find_depth(parent) + 1 if parent else 0
+        return depth[recipe]
+    batches = {}
+    for recipe in recipes:
+        batches.setdefault(find_depth(recipe), []).append(recipe)
+
+    results = {}
+    scopes = {}
+    for level in sorted(batches):
+        todo = []
+        for recipe in batches[level]:
+            text = recipe.read_text()
+            scope = scopes.get(parents[recipe], {})
+            key = cache.key(text, parser_id, scope) if cache else None
+            cached = cache.get(key) if cache else None
+            if cached:
+                results[recipe], scopes[recipe] = cached
+            else:
+                todo.append((recipe, key, text, scope))
+        done = map_jobs(parse_one, [(parser, str(recipe), text, scope) for recipe, _, text, scope in todo], jobs)
+        for (recipe, key, _, _), (result, error) in zip(todo, done):
+            if error:
+                sys.exit(f"{recipe}:{error}")
+            results[recipe], scopes[recipe] = result
+            if cache:
+                cache.put(key, *result)
+    return [(recipe, results[recipe]) for recipe in recipes]
+
+def added(container, size: int):
+    if isinstance(container, dict):
+        return list(container.items())[size:]
+    return container[size:]
+
+def truncate(container, size: int):
+    if isinstance(container, dict):
+        items = list(container.items())[:size]
+        container.clear()
+        container.update(items)
+    else:
+        del container[size:]
+
+def extend(container, items):
+    if isinstance(container, dict):
+        container.update(items)
+    else:
+        container.extend(items)
+
+def generate_one(i: int):
+    recipe, statement = statements[i]
+    if current_recipe.get('name') != str(recipe):
+        current_recipe.update({
+            'name': str(recipe),
+            'dir': recipe.parents[0],
+            'parsed': parsed_recipes[recipe]
+        })
+    sizes = [len(container) for container in shared]
+    w = writer()
+    nodes, w.nodes = w.nodes, []
+    try:
+        with trace.span(statement.arguments.get('name', statement.name), 'module', type=statement.name, recipe=str(recipe)):
+            statement.run()
+        fragment = w.nodes if keep_nodes else w.text(w.nodes)
+    finally:
+        w.nodes = nodes
+    return fragment, [added(container, size) for container, size in zip(shared, sizes)]
+
+def generation_keys(ordered, recipes, salt: str):
+    """
+    Return a key for each statement covering everything its output may
+    depend on: the settings, its whole recipe and, through their keys,
+    the modules it depends on.
+    """
+    digests = dict()
+    for recipe, parsed in recipes:
+        h = hashlib.sha256(str(recipe).encode())
+        h.update(json.dumps([[s.name, s.arguments] for s in parsed if isinstance(s, Module)], sort_keys=True, default=list).encode())
+        digests[recipe] = h.hexdigest()
+
+    index = dict()
+    keys = []
+    for i, (recipe, statement) in enumerate(ordered):
+        h = hashlib.sha256(salt.encode())
+        h.update(digests[recipe].encode())
+        if isinstance(statement, Module):
+            h.update(f"\0{statement.name}\0{statement.arguments.get('name', '')}".encode())
+            for dep in sorted(set(depgraph.module_deps(statement.arguments))):
+                h.update(f"\0{dep}={keys[index[dep]] if dep in index else ''}".encode())
+            if 'name' in statement.arguments:
+                index.setdefault(statement.arguments['name'], i)
+        keys.append(h.hexdigest())
+    return keys
+
+def generate(ordered, recipes, jobs: int, cache=None, salt: str = '', nodes: bool = False):
+    """
+    Generate the statements in order and return their fragments, with
+    the shared containers filled as a serial run would have filled them.
+    """
+    global keep_nodes
+    keep_nodes = nodes
+    statements[:] = ordered
+    parsed_recipes.clear()
+    parsed_recipes.update(recipes)
+
+    keys = generation_keys(ordered, recipes, salt) if cache else []
+    depths = depgraph.levels(ordered)
+    batches = {}
+    for i, depth in enumerate(depths):
+        batches.setdefault(depth, []).append(i)
+
+    initial = [len(container) for container in shared]
+    results = [None] * len(ordered)
+    for depth in sorted(batches):
+        todo = []
+        for i in batches[depth]:
+            cached = cache.read(keys[i]) if cache else None
+            if cached and len(cached['additions']) == len(shared):
+                results[i] = cached['fragment'], cached['additions']
+            else:
+                todo.append(i)
+        trace.count('reused modules', len(batches[depth]) - len(todo))
+        # modules run here have already added their bits, modules run
+        # elsewhere haven't; start over from the same point for both
+        sizes = [len(container) for container in shared]
+        done = map_jobs(generate_one, todo, jobs)
+        for container, size in zip(shared, sizes):
+            truncate(container, size)
+        for i, result in zip(todo, done):
+            results[i] = result
+            if cache:
+                cache.write(keys[i], {'fragment': result[0], 'additions': result[1]})
+        for i in batches[depth]:
+            for container, items in zip(shared, results[i][1]):
+                extend(container, items)
+
+    for container, size in zip(shared, initial):
+        truncate(container, size)
+    fragments = []
+    for fragment, additions in results:
+        fragments.append(fragment)
+        for container, items in zip(shared, additions):
+            extend(container, items)
+    return fragments
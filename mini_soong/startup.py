@@ -0,0 +1,61 @@
+# Import time profiling
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# By the time the command line is parsed most imports have happened,
+# so mini-soong runs itself again in an interpreter timing every
+# import, including the ones made later on, and summarises that.
+
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+entry = 'import sys; sys.argv[0] = "mini-soong"; from mini_soong.main import run; run()'
+
+import_time = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| \s*(\S+)')
+
+def profile(argv, top: int = 30) -> int:
+    package_root = str(Path(__file__).resolve().parents[1])
+    pythonpath = [package_root] + ([os.environ['PYTHONPATH']] if 'PYTHONPATH' in os.environ else [])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(pythonpath))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', entry] + argv,
+                          env=env, stderr=subprocess.PIPE, text=True)
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        m = import_time.match(line)
+        if m:
+            own, cumulative, name = m.groups()
+            modules.append((int(own), int(cumulative), name))
+        elif not line.startswith('import time:'):
+            print(line, file=sys.stderr)
+
+    total = sum(own for own, _, _ in modules)
+    print(f"imported {len(modules)} modules in {total / 1000:.1f} ms", file=sys.stderr)
+    print(f"{'self ms':>9} {'cumul. ms':>9}  module", file=sys.stderr)
+    for own, cumulative, name in sorted(modules, reverse=True)[:top]:
+        print(f"{own / 1000:9.1f} {cumulative / 1000:9.1f}  {name}", file=sys.stderr)
+    return proc.returncode
@@ -0,0 +1,79 @@
+# Test results
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# The check target keeps the output of each test run in a log, and the
+# results of googletest suites as JSON next to it. This adds them up
+# and lists the slowest tests, to tell which suites are worth sharding.
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+def seconds(value) -> float:
+    # googletest writes times as "0.012s"
+    return float(str(value).rstrip('s') or 0)
+
+def load(path: Path):
+    """
+    Return the tests of a googletest JSON report, as (name, seconds,
+    passed) tuples, and the time the whole run took.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    cases = []
+    for suite in data.get('testsuites', []):
+        for test in suite.get('testsuite', []):
+            cases.append((f"{suite['name']}.{test['name']}", seconds(test.get('time', 0)), not test.get('failures')))
+    return cases, seconds(data.get('time', 0))
+
+def report(logs, top: int = 10, file=sys.stdout):
+    cases = []
+    for log in logs:
+        results = Path(log).with_suffix('.json')
+        if not results.exists():
+            print(f"{Path(log).stem}: no per-test results", file=file)
+            continue
+        run, elapsed = load(results)
+        failed = sum(1 for _, _, passed in run if not passed)
+        print(f"{results.stem}: {len(run)} tests, {failed} failed, {elapsed:.2f} s", file=file)
+        cases += [(f"{results.stem}: {name}", time) for name, time, _ in run]
+    if cases:
+        print("slowest tests:", file=file)
+        for name, time in sorted(cases, key=lambda c: c[1], reverse=True)[:top]:
+            print(f"  {time:8.3f} s  {name}", file=file)
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(prog='mini-soong test-report', description='Summarise the results of the check target')
+    parser.add_argument('logs', metavar='LOG', nargs='+', help='test logs written by the check target')
+    parser.add_argument('--top', metavar='N', type=int, default=10, help='how many of the slowest tests to list (default: 10)')
+    args = parser.parse_args(argv)
+    try:
+        report(args.logs, args.top)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,134 @@
+# Build timing
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# With --time-log, the compile, archive and link commands are wrapped
+# in a couple of lines of shell appending what was built, when it
+# started and finished, and what it was built from to a log, which
+# `mini-soong report` then summarises. Only date(1) is run in addition
+# to the command itself, and nothing is logged when it fails.
+
+import argparse
+import os
+import sys
+from .model import options
+
+# {out} starts, finishes, was built from {in} {implicit}
+record = 'echo "{out} $$start $$(date +%s%N) {in} {implicit}" >> {TIME_LOG}'
+
+def timed(command: str) -> str:
+    """
+    Wrap a rule command with a timer if timing was asked for.
+    """
+    if not options.get('time_log'):
+        return command
+    return f"start=$$(date +%s%N) && {command} && {record}"
+
+def read_log(path: str) -> dict:
+    # a target built again replaces what was logged about it before
+    targets = dict()
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            target, start, end, *inputs = fields
+            try:
+                targets[target] = (int(start), int(end), inputs)
+            except ValueError:
+                continue
+    return targets
+
+def critical_path(targets: dict) -> list:
+    """
+    Return the chain of logged targets, each built from the previous one,
+    taking the longest time in total.
+    """
+    longest = dict()
+    # shared libraries are linked through their symlinks
+    real = {os.path.realpath(target): target for target in targets}
+
+    def visit(target):
+        if target not in longest:
+            # break cycles in a log mixing several builds
+            longest[target] = (0, None)
+            start, end, inputs = targets[target]
+            deps = [dep if dep in targets else real.get(os.path.realpath(dep)) for dep in inputs]
+            before = max(((visit(dep), dep) for dep in deps if dep), default=(0, None))
+            longest[target] = (end - start + before[0], before[1])
+        return longest[target][0]
+
+    if not targets:
+        return []
+    last = max(targets, key=visit)
+    path = []
+    while last:
+        path.append(last)
+        last = longest[last][1]
+    return path[::-1]
+
+def report(path: str, top: int = 20, file=sys.stdout):
+    targets = read_log(path)
+    if not targets:
+        print(f"nothing logged in {path}", file=file)
+        return
+
+    def duration(target):
+        start, end, _ = targets[target]
+        return (end - start) / 1e9
+
+    first = min(start for start, _, _ in targets.values())
+    last = max(end for _, end, _ in targets.values())
+    total = sum(duration(target) for target in targets)
+    print(f"{len(targets)} targets, {total:.2f} s of work in {(last - first) / 1e9:.2f} s", file=file)
+
+    chain = critical_path(targets)
+    print(f"\ncritical path, {sum(duration(target) for target in chain):.2f} s:", file=file)
+    for target in chain:
+        print(f"  {duration(target):8.2f} s  {target}", file=file)
+
+    objects = [target for target in targets if target.endswith('.o')]
+    if objects:
+        print("\nslowest objects:", file=file)
+        for target in sorted(objects, key=duration, reverse=True)[:top]:
+            print(f"  {duration(target):8.2f} s  {target}", file=file)
+
+    others = [target for target in targets if not target.endswith('.o')]
+    if others:
+        print("\nslowest libraries and binaries:", file=file)
+        for target in sorted(others, key=duration, reverse=True)[:top]:
+            print(f"  {duration(target):8.2f} s  {target}", file=file)
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(prog='mini-soong report', description='Summarise the build times logged with --time-log')
+    parser.add_argument('log', metavar='LOG', type=str, help='the log written during the build')
+    parser.add_argument('--top', metavar='N', type=int, default=20, help='how many of the slowest targets to list (default: 20)')
+    args = parser.parse_args(argv)
+    try:
+        report(args.log, args.top)
+    except OSError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
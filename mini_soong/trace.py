@@ -0,0 +1,123 @@
+# Tracing and statistics
+#
+# Copyright 2020 Andrej Shadura
+#
+# SPDX-License-Identifier: MIT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Spans are recorded as Chrome trace events, which chrome://tracing
+# and Perfetto can show; worker processes send theirs back along with
+# their results. Nothing is recorded unless enable() has been called.
+
+import json
+import os
+import sys
+import threading
+import time
+from functools import wraps
+from contextlib import contextmanager, nullcontext
+
+enabled = False
+
+events = list()
+counts = dict()
+
+start = time.perf_counter_ns()
+
+def now() -> float:
+    # microseconds, the unit of the trace format
+    return (time.perf_counter_ns() - start) / 1000
+
+def count(name: str, n: int = 1):
+    if enabled:
+        counts[name] = counts.get(name, 0) + n
+
+def enable():
+    global enabled
+    enabled = True
+
+@contextmanager
+def record(name: str, category: str, args: dict):
+    begin = now()
+    try:
+        yield
+    finally:
+        events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': begin,
+            'dur': now() - begin,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+def span(name: str, category: str = 'phase', **args):
+    if not enabled:
+        return nullcontext()
+    return record(name, category, args)
+
+def traced(category: str):
+    """
+    Record every call of the decorated function as a span.
+    """
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(fn.__name__, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def changes(before_events: int, before_counts: dict):
+    """
+    What was recorded since: sent back to the main process by workers.
+    """
+    return events[before_events:], {k: v - before_counts.get(k, 0) for k, v in counts.items() if v != before_counts.get(k, 0)}
+
+def merge(new_events, new_counts: dict):
+    events.extend(new_events)
+    for k, v in new_counts.items():
+        counts[k] = counts.get(k, 0) + v
+
+def write(path: str):
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+def summary(file=sys.stderr):
+    print("phases:", file=file)
+    for event in sorted(events, key=lambda e: e['ts']):
+        if event['cat'] == 'phase' and event['pid'] == os.getpid():
+            print(f"  {event['name']:<14} {event['dur'] / 1000:10.1f} ms", file=file)
+    print("counts:", file=file)
+    for name, value in sorted(counts.items()):
+        print(f"  {name:<14} {value:10}", file=file)
+    # parsing a recipe and generating its modules, to find the expensive ones
+    recipes = dict()
+    for event in events:
+        if event['cat'] in ('parse', 'module'):
+            recipe = event['args']['recipe']
+            recipes[recipe] = recipes.get(recipe, 0) + event['dur']
+    if recipes:
+        print("slowest recipes:", file=file)
+        for recipe, dur in sorted(recipes.items(), key=lambda r: r[1], reverse=True)[:10]:
+            print(f"  {dur / 1000:10.1f} ms  {recipe}", file=file)
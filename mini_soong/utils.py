@@ -1,4 +1,6 @@
 from typing import Mapping, Sequence
+from .backends import writer
+from . import trace
 
 def mergedefaults(a, b):
     for k, v in b.items():
@@ -32,19 +34,20 @@ def add_dicts(a, b):
 def print_vars(target, kv, names):
     for name in names:
         if name in kv:
-            print(f"{target}_{name.upper():<8} = {' '.join(kv[name])}")
+            writer().variable(f"{target}_{name.upper()}", kv[name], align=len(target) + 9)
 
 import re
 from functools import lru_cache
 from pathlib import Path
-from debian.deb822 import Deb822
-from debian.changelog import Changelog
-from debian.debian_support import Version
+
+# python-debian takes a while to import and is only needed for
+# shared libraries, so it's imported when first used
 
 @lru_cache(maxsize=None)
 def deb_version():
     changelog = Path('debian/changelog')
     if changelog.exists():
+        from debian.changelog import Changelog
         try:
             with changelog.open() as f:
                 ch = Changelog(f, max_blocks=1)
@@ -65,6 +68,7 @@ def mangle_lib(lib: str) -> str:
     lib = re.sub(r'\.so$', '', lib)
     return lib.replace('_', '-').lower()
 
+@trace.traced('builder')
 def match_libs(libs):
     pkg_ver = deb_version()
     if pkg_ver:
@@ -83,6 +87,7 @@ def match_libs(libs):
 def parse_control():
     control = Path('debian/control')
     if control.exists():
+        from debian.deb822 import Deb822
         try:
             with control.open() as f:
                 bin_pkgs = [p['Package'] for p in Deb822.iter_paragraphs(f) if 'Package' in p]
@@ -23,12 +23,37 @@ sub DESCRIPTION {
 	"mini-Soong"
 }
 
+sub output_file {
+	my $this=shift;
+	return $this->{backend} eq "ninja" ? "build.ninja" : "soong.mk";
+}
+
+# mini-soong and the build tools run in the source directory,
+# the build directory only receives what the build produces
+sub build_file {
+	my $this=shift;
+	return $this->get_build_rel2sourcedir($this->output_file());
+}
+
 sub clean {
 	my $this=shift;
-	if (-e $this->get_buildpath("soong.mk")) {
-		$this->SUPER::clean(@_);
+	my $build_file=$this->build_file();
+	if ($this->{backend} eq "ninja") {
+		if (-e $this->get_sourcepath($build_file)) {
+			$this->doit_in_sourcedir("ninja", "-f", $build_file, "-t", "clean");
+		}
+		$this->doit_in_sourcedir('rm', '-f', $build_file, "$build_file.fingerprint", '.ninja_log', '.ninja_deps');
+	}
+	else {
+		if (-e $this->get_sourcepath($build_file)) {
+			$this->make_first_existing_target(['clean'], @_);
+		}
+		$this->doit_in_sourcedir('rm', '-f', $build_file, "$build_file.fingerprint");
+	}
+	$this->doit_in_sourcedir('rm', '-rf', '.mini-soong-cache');
+	if ($this->get_builddir()) {
+		$this->doit_in_sourcedir('rm', '-rf', $this->get_build_rel2sourcedir());
 	}
-	$this->doit_in_builddir('rm', '-f', 'soong.mk');
 }
 
 sub configure {
@@ -36,14 +61,83 @@ sub configure {
 
 	$this->mkdir_builddir();
 
-	my $builddir = $this->get_builddir();
-
 	my @opts;
-	if (-e $this->get_buildpath("Android.bp")) {
+	push @opts, "--backend=$this->{backend}";
+	if ($this->get_parallel() > 0) {
+		push @opts, "--jobs=" . $this->get_parallel();
+	}
+	if ($this->get_builddir()) {
+		push @opts, "--out-dir=" . $this->get_build_rel2sourcedir();
+	}
+	if (-e $this->get_sourcepath("Android.bp")) {
 		push @opts, "-o";
-		push @opts, "soong.mk";
+		push @opts, $this->build_file();
+	}
+	if ($this->{backend} eq "ninja") {
+		# ninja has no command line variables, so bake the paths in
+		my $prefix = "/usr";
+		push @opts, "--define", "prefix=${prefix}";
+		my $multiarch=dpkg_architecture_value("DEB_HOST_MULTIARCH");
+		if (defined $multiarch) {
+			push @opts, "--define", "libdir=${prefix}/lib/$multiarch";
+		}
+	}
+	$this->doit_in_sourcedir("mini-soong", @opts, @_);
+}
+
+sub do_ninja {
+	my $this=shift;
+
+	my @opts;
+	push @opts, "-f", $this->build_file();
+	push @opts, "-v";
+	if ($this->get_parallel() > 0) {
+		push @opts, "-j" . $this->get_parallel();
+	}
+	$this->doit_in_sourcedir("ninja", @opts, @_);
+}
+
+sub build {
+	my $this=shift;
+	if ($this->{backend} eq "ninja") {
+		return $this->do_ninja(@_);
+	}
+	$this->SUPER::build(@_);
+}
+
+sub exists_ninja_target {
+	my ($this, $target) = @_;
+	my @opts=("-f", $this->build_file(), "-t", "query", $target);
+	my $sourcedir = $this->get_sourcedir();
+	unshift @opts, "-C", $sourcedir if $sourcedir ne ".";
+	my $pid = fork();
+	return 0 unless defined $pid;
+	if ($pid == 0) {
+		open(STDOUT, ">", "/dev/null");
+		open(STDERR, ">", "/dev/null");
+		exec("ninja", @opts) or exit(127);
+	}
+	waitpid($pid, 0);
+	return $? == 0;
+}
+
+sub test {
+	my $this=shift;
+	if ($this->{backend} eq "ninja") {
+		# cc_test modules are run by the check target
+		return $this->do_ninja("check", @_) if $this->exists_ninja_target("check");
+		return;
 	}
-	$this->doit_in_builddir("mini-soong", @opts, @_);
+	$this->SUPER::test(@_);
+}
+
+sub install {
+	my $this=shift;
+	my $destdir=shift;
+	if ($this->{backend} eq "ninja") {
+		return $this->doit_in_sourcedir("env", "DESTDIR=$destdir", "ninja", "-f", $this->build_file(), "-v", "install", @_);
+	}
+	$this->SUPER::install($destdir, @_);
 }
 
 sub do_make {
@@ -55,7 +149,11 @@ sub do_make {
 
 	my @opts;
 	push @opts, "-f";
-	push @opts, "soong.mk";
+	push @opts, $this->build_file();
+	# so that tests and other independent targets run side by side
+	if ($this->get_parallel() > 0) {
+		push @opts, "-j" . $this->get_parallel();
+	}
 	my $prefix = "/usr";
 	push @opts, "prefix=${prefix}";
 	push @opts, "mandir=${prefix}/share/man";
@@ -74,12 +172,19 @@ sub do_make {
 	if (exists($this->{_run_make_as_root}) and $this->{_run_make_as_root}) {
 		@root_cmd = gain_root_cmd();
 	}
-	$this->doit_in_builddir(@root_cmd, $this->{makecmd}, @opts, @_);
+	$this->doit_in_sourcedir(@root_cmd, $this->{makecmd}, @opts, @_);
 }
 
 sub exists_make_target {
-	my $this=shift;
-	return $this->SUPER::exists_make_target(@_, "-f", "soong.mk");
+	my ($this, $target) = @_;
+	# like the makefile build system, but in the source directory
+	my @opts=("-s", "-n", "--no-print-directory", "-f", $this->build_file());
+	my $sourcedir = $this->get_sourcedir();
+	unshift @opts, "-C", $sourcedir if $sourcedir ne ".";
+	open(my $make, "-|", $this->{makecmd}, @opts, $target) or return 0;
+	my $ret = do { local $/; <$make> };
+	close($make);
+	return defined $ret && length $ret;
 }
 
 sub check_auto_buildable {
@@ -94,6 +199,7 @@ sub new {
 	my $class=shift;
 	my $this=$class->SUPER::new(@_);
 	$this->{makecmd} = "make";
+	$this->{backend} = $ENV{MINI_SOONG_BACKEND} // "make";
 	return $this;
 }
 